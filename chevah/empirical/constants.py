@@ -7,3 +7,6 @@ from __future__ import division
 from __future__ import absolute_import
 
 TEST_NAME_MARKER = u'-cpț'
+
+# Name of the thread used to interrupt tests which are taking too long.
+WATCHDOG_THREAD_NAME = 'empirical_watchdog'
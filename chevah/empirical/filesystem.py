@@ -27,8 +27,10 @@ class LocalTestFilesystem(LocalFilesystem):
         """
         Create an unique temp folder.
         """
+        from chevah.empirical.mockup import ChevahCommonsFactory
         super(LocalTestFilesystem, self).__init__(avatar=avatar)
-        self._temp_uuid = u'%s%s' % (uuid.uuid4(), TEST_NAME_MARKER)
+        self._temp_uuid = ChevahCommonsFactory.recordGeneratedName(
+            u'%s%s' % (uuid.uuid4(), TEST_NAME_MARKER))
         self.__class__.__temporary_folders__.append(self.temp_segments)
 
     @property
@@ -179,8 +181,10 @@ class LocalTestFilesystem(LocalFilesystem):
 
     def createFileInHome(self, segments=None, **args):
         '''Create a file in home folder.'''
+        from chevah.empirical.mockup import ChevahCommonsFactory
         if segments is None:
-            segments = [str(uuid.uuid1()) + TEST_NAME_MARKER]
+            segments = [ChevahCommonsFactory.recordGeneratedName(
+                str(uuid.uuid1()) + TEST_NAME_MARKER)]
 
         file_segments = self.home_segments[:]
         file_segments.extend(segments)
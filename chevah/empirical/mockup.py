@@ -22,18 +22,9 @@ import string
 import threading
 import uuid
 
-from OpenSSL import SSL, crypto
-
-try:
-    from twisted.internet import address, defer
-    from twisted.internet.protocol import Factory
-    from twisted.internet.tcp import Port
-except ImportError:
-    # Twisted support is optional.
-    pass
-
 from chevah.compat import DefaultAvatar
 from chevah.empirical.filesystem import LocalTestFilesystem
+from chevah.empirical.ports import allocator
 from chevah.empirical.constants import (
     TEST_NAME_MARKER,
     )
@@ -74,6 +65,8 @@ class _ThreadedHTTPServer(Thread):
     Only use it for testing together with HTTPServerContext.
     """
     TIMEOUT = 1
+    # Seconds to wait before trying again when the port is in use.
+    RETRY_INTERVAL = 0.05
 
     def __init__(
             self, responses=None, ip='127.0.0.1', port=0, debug=False,
@@ -101,8 +94,8 @@ class _ThreadedHTTPServer(Thread):
                 if (isinstance(e, socket.error) and
                         errno.errorcode[e.args[0]] == 'EADDRINUSE' and
                         timeout < self.TIMEOUT):
-                    timeout += 1
-                    time.sleep(1)
+                    timeout += self.RETRY_INTERVAL
+                    time.sleep(self.RETRY_INTERVAL)
                 else:
                     self.cond.notifyAll()
                     self.cond.release()
@@ -147,6 +140,8 @@ class HTTPServerContext(object):
 
          * ip - IP to listen. Leave empty to listen to any interface.
          * port - Port to listen. Leave 0 to pick a random port.
+                  Use `factory.getFreePort` for a port known before the
+                  server is started.
          * server_version - HTTP version used by server.
          * responses - A list of ResponseDefinition defining the behavior of
                         this server.
@@ -456,6 +451,12 @@ class TestSSLContextFactory(object):
 # It starts with a different value to have different values between same
 # test runs.
 _unique_id = random.randint(0, 5000)
+# Names generated for files and folders since the last call to
+# popGeneratedNames, so that tests can only check these names for leftovers.
+_generated_names = set()
+# Suffixes added to the generated names for the files derived from them,
+# such as lock files, which are also checked for leftovers.
+_derived_suffixes = set()
 
 
 class ChevahCommonsFactory(object):
@@ -472,6 +473,41 @@ class ChevahCommonsFactory(object):
         _unique_id += 1
         return _unique_id
 
+    @classmethod
+    def recordGeneratedName(cls, name):
+        """
+        Record `name` as used for a file or folder of the current test.
+
+        Returns the name.
+        """
+        _generated_names.add(name)
+        return name
+
+    @classmethod
+    def popGeneratedNames(cls):
+        """
+        Return the names recorded since the last call and forget them.
+        """
+        names = set(_generated_names)
+        _generated_names.clear()
+        return names
+
+    @classmethod
+    def recordDerivedSuffix(cls, suffix):
+        """
+        Record `suffix` as added to the generated names for the files
+        derived from them, so that these files are also checked for
+        leftovers at the end of each test.
+        """
+        _derived_suffixes.add(suffix)
+
+    @classmethod
+    def getDerivedSuffixes(cls):
+        """
+        Return the suffixes recorded for the derived files.
+        """
+        return set(_derived_suffixes)
+
     def ascii(self):
         """
         Return a unique (per session) ASCII string.
@@ -492,6 +528,8 @@ class ChevahCommonsFactory(object):
         """
         Return a Twisted TCP Port.
         """
+        from twisted.internet.protocol import Factory
+        from twisted.internet.tcp import Port
         if factory is None:
             factory = Factory()
 
@@ -562,7 +600,7 @@ class ChevahCommonsFactory(object):
                     for ignore in range(extra_length)
                     )
 
-        return base + extra_text + TEST_NAME_MARKER
+        return self.recordGeneratedName(base + extra_text + TEST_NAME_MARKER)
 
     def makeLocalTestFilesystem(self, avatar=None):
         if avatar is None:
@@ -590,14 +628,26 @@ class ChevahCommonsFactory(object):
     def makeFilename(self, length=32, prefix=u'', suffix=u''):
         '''Return a random valid filename.'''
         name = str(self.getUniqueInteger()) + TEST_NAME_MARKER
-        return prefix + name + ('a' * (length - len(name))) + suffix
+        return self.recordGeneratedName(
+            prefix + name + ('a' * (length - len(name))) + suffix)
+
+    def getFreePort(self, ip='127.0.0.1'):
+        """
+        Return a port which is free on `ip`, and is not handed out again
+        until the end of the test.
+        """
+        return allocator.allocate(ip)
 
     def makeIPv4Address(self, host='localhost', port=None, protocol='TCP'):
         """
         Creates an IPv4 address.
+
+        When `port` is not given, a port which is free on the local host
+        is used, as `host` might not be a local address.
         """
+        from twisted.internet import address
         if port is None:
-            port = random.randrange(20000, 30000)
+            port = self.getFreePort()
 
         ipv4 = address.IPv4Address(protocol, host, port)
         return ipv4
@@ -607,6 +657,7 @@ class ChevahCommonsFactory(object):
         certificate_path=None, key_path=None,
             ):
         '''Create an SSL context.'''
+        from OpenSSL import SSL
         if method is None:
             method = SSL.SSLv23_METHOD
 
@@ -636,6 +687,7 @@ class ChevahCommonsFactory(object):
 
     def makeSSLCertificate(self, path):
         '''Return an SSL instance loaded from path.'''
+        from OpenSSL import crypto
         certificate = None
         cert_file = open(path, 'r')
         try:
@@ -649,12 +701,14 @@ class ChevahCommonsFactory(object):
         """
         Creates a deferred for which already succeeded.
         """
+        from twisted.internet import defer
         return defer.succeed(data)
 
     def makeDeferredFail(self, failure=None):
         """
         Creates a deferred which already failed.
         """
+        from twisted.internet import defer
         return defer.fail(failure)
 
 
@@ -4,8 +4,6 @@ This plugin provides memory usage .
 from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
-from builtins import range
-import operator
 
 import nose
 from nose.plugins.base import Plugin
@@ -18,18 +16,21 @@ class MemoryUsage(Plugin):
     """
     This plugin reports memory for each test.
 
-    It reports the 10 most memory hungry tests.
+    It reports the 10 tests with the highest memory peak, and the 10 tests
+    leaving the most memory allocated, measured using the resident set
+    size and, when allocations are traced using tracemalloc, the memory
+    allocated by Python.
     """
 
     name = 'memory-usage'
     score = 1
 
-    def getPeakMemoryUsage(self):
+    def getTestCase(self):
         """
         Method to prevent circular import.
         """
         from chevah.empirical import EmpiricalTestCase
-        return EmpiricalTestCase.getPeakMemoryUsage()
+        return EmpiricalTestCase
 
     def configure(self, options, config):
         """Configures the test timer plugin."""
@@ -40,36 +41,79 @@ class MemoryUsage(Plugin):
         """
         Called before starting the test.
         """
-        self._start_rss = self.getPeakMemoryUsage()
+        test_case = self.getTestCase()
+        self._peak_reset = test_case.resetPeakMemoryUsage()
+        self._start_peak = test_case.getPeakMemoryUsageSinceReset()
+        self._start_rss = test_case.getCurrentMemoryUsage()
+        self._start_python = test_case.getPythonMemoryUsage()
 
     def stopTest(self, test):
-        end_rss = self.getPeakMemoryUsage()
-        self._memory_usage[test.id()] = end_rss - self._start_rss
+        """
+        Called after the test was executed.
+        """
+        test_case = self.getTestCase()
+        peak = test_case.getPeakMemoryUsageSinceReset()
+        end_rss = test_case.getCurrentMemoryUsage()
+        end_python = test_case.getPythonMemoryUsage()
+
+        if self._peak_reset:
+            peak_usage = peak - self._start_rss
+        else:
+            # Only the increase of the process peak is known.
+            peak_usage = peak - self._start_peak
+
+        python_usage = None
+        if end_python is not None and self._start_python is not None:
+            python_usage = end_python - self._start_python
+
+        self._memory_usage[test.id()] = (
+            peak_usage, end_rss - self._start_rss, python_usage)
 
     def report(self, stream):
-        """Report the test times"""
+        """Report the memory usage"""
         if not self.enabled:
             return
 
-        sorted_usage = sorted(
-            iter(self._memory_usage.items()),
-            key=operator.itemgetter(1),
-            )
-
         stream.writeln('-' * 70)
         stream.writeln('Memory usage top %s report:\n' % (TOP_COUNT))
-        tests_count = len(sorted_usage)
-        if not tests_count:
+        if not self._memory_usage:
             stream.writeln('No tests were executed.')
             return
 
-        test_start = tests_count - TOP_COUNT
-        if test_start < 0:
-            test_start = 0
+        sorted_usage = sorted(
+            iter(self._memory_usage.items()),
+            key=lambda item: item[1][0],
+            reverse=True,
+            )
+        for test_id, usage in sorted_usage[:TOP_COUNT]:
+            stream.writeln('%d KB peak: %s' % (usage[0], test_id))
 
-        for index in range(tests_count - 1, test_start - 1, -1):
-            test_id, memory_usage = sorted_usage[index]
-            stream.writeln("%0.4f: %s" % (memory_usage, test_id))
+        stream.writeln(
+            '\nMemory left allocated top %s report:\n' % (TOP_COUNT))
+        sorted_usage = sorted(
+            iter(self._memory_usage.items()),
+            key=self._getLeftAllocated,
+            reverse=True,
+            )
+        for test_id, usage in sorted_usage[:TOP_COUNT]:
+            if usage[2] is None:
+                stream.writeln('%d KB RSS: %s' % (usage[1], test_id))
+            else:
+                stream.writeln('%d KB Python, %d KB RSS: %s' % (
+                    usage[2], usage[1], test_id))
+
+    @staticmethod
+    def _getLeftAllocated(item):
+        """
+        Return the memory left allocated by the test from the usage `item`.
+
+        The Python allocations are used when traced, as they are not
+        affected by the memory kept by the allocator.
+        """
+        _, (_, rss_usage, python_usage) = item
+        if python_usage is None:
+            return rss_usage
+        return python_usage
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+"""
+This plugin provides reactor usage.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import operator
+
+import nose
+from nose.plugins.base import Plugin
+
+# Number of tests and slow calls to show in final report.
+TOP_COUNT = 10
+
+
+class ReactorUsage(Plugin):
+    """
+    This plugin reports the time spent by the reactor for each test.
+
+    It reports the 10 tests spending the most time in the reactor, with
+    their slowest reactor iteration, and the 10 slowest delayed calls.
+    """
+
+    name = 'reactor-usage'
+    score = 1
+
+    def getReports(self):
+        """
+        Method to prevent circular import.
+        """
+        from chevah.empirical.testcase import reactor_reports
+        return reactor_reports
+
+    def enableInstrumentation(self):
+        """
+        Method to prevent circular import.
+        """
+        from chevah.empirical.testcase import TwistedTestCase
+        TwistedTestCase.REACTOR_INSTRUMENTATION = True
+
+    def configure(self, options, config):
+        """Configures the reactor usage plugin."""
+        super(ReactorUsage, self).configure(options, config)
+        self._reactor_usage = {}
+        self._slow_calls = {}
+        if self.enabled:
+            self.enableInstrumentation()
+
+    def stopTest(self, test):
+        """
+        Called after the test was executed.
+        """
+        reports = self.getReports()
+        while reports:
+            self.addReport(reports.popleft())
+
+    def addReport(self, report):
+        """
+        Aggregate the reactor `report` for a test.
+        """
+        slowest = max([
+            run_until_current + do_iteration
+            for run_until_current, do_iteration, _
+            in report.iteration_times
+            ] or [0])
+        self._reactor_usage[report.test_id] = (
+            report.run_until_current + report.do_iteration,
+            report.iterations,
+            report.delayed_calls,
+            slowest,
+            )
+        for name, duration in report.slow_calls:
+            count, total, maximum = self._slow_calls.get(name, (0, 0, 0))
+            self._slow_calls[name] = (
+                count + 1, total + duration, max(maximum, duration))
+
+    def report(self, stream):
+        """Report the reactor usage"""
+        if not self.enabled:
+            return
+
+        stream.writeln('-' * 70)
+        stream.writeln('Reactor usage top %s report:\n' % (TOP_COUNT))
+        if not self._reactor_usage:
+            stream.writeln('No tests were executed.')
+            return
+
+        sorted_usage = sorted(
+            iter(self._reactor_usage.items()),
+            key=operator.itemgetter(1),
+            reverse=True,
+            )
+        for test_id, usage in sorted_usage[:TOP_COUNT]:
+            stream.writeln(
+                "%0.4f: %s (%d iterations, %d delayed calls, "
+                "%0.4f slowest iteration)" % (
+                    usage[0], test_id, usage[1], usage[2], usage[3]))
+
+        stream.writeln('\nSlow delayed calls top %s report:\n' % (TOP_COUNT))
+        sorted_calls = sorted(
+            iter(self._slow_calls.items()),
+            key=lambda item: item[1][2],
+            reverse=True,
+            )
+        for name, (count, total, maximum) in sorted_calls[:TOP_COUNT]:
+            stream.writeln(
+                "%0.4f: %s (%d calls, %0.4f total)" % (
+                    maximum, name, count, total))
+
+
+if __name__ == '__main__':
+    nose.main(addplugins=[ReactorUsage()])
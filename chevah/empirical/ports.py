@@ -0,0 +1,154 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Allocation of free ports for tests.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from builtins import object
+from builtins import range
+import os
+import re
+import socket
+import sys
+import threading
+
+
+class PortAllocator(object):
+    """
+    Hands out ports which are free, from a range of ports dedicated to the
+    current worker, so that tests running in parallel processes don't use
+    the same ports.
+
+    The worker is identified by the `EMPIRICAL_WORKER_ID` or
+    `PYTEST_XDIST_WORKER` environment variables, or by the number of the
+    multiprocessing child process, as started by the nose multiprocess
+    plugin. Otherwise, the process is the only worker.
+
+    The reservation is only kept by this process. The ports are not kept
+    bound, so a port is only guaranteed to be free when it is handed out.
+    Processes which are not workers of the same test run can still use
+    the same ports, and they are skipped only while bound.
+    """
+
+    FIRST_PORT = 20000
+    LAST_PORT = 30000
+    PARTITION_SIZE = 500
+
+    def __init__(self, worker_id=None):
+        self._worker_id = worker_id
+        # The process for which the worker range was computed.
+        self._pid = None
+        self._first_port = None
+        self._next = 0
+        self._reserved = set()
+        self._lock = threading.Lock()
+        # Ports allocated since the last release of the allocated ports.
+        self.allocated = []
+
+    @staticmethod
+    def _getWorkerID():
+        """
+        Return the number of the current worker.
+        """
+        for name in ['EMPIRICAL_WORKER_ID', 'PYTEST_XDIST_WORKER']:
+            digits = re.sub(r'[^0-9]', '', os.environ.get(name, ''))
+            if digits:
+                return int(digits)
+
+        # A child process already has multiprocessing imported.
+        multiprocessing = sys.modules.get('multiprocessing', None)
+        if multiprocessing is not None:
+            # Child processes are numbered from 1, in the order in which
+            # they were started.
+            identity = multiprocessing.current_process()._identity
+            if identity:
+                return identity[0]
+
+        return 0
+
+    def _getFirstPort(self):
+        """
+        Return the first port from the worker range.
+
+        The range is computed on first use, and again after a fork, so
+        that the workers forked after this module was imported don't
+        share the range of the parent process.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            worker_id = self._worker_id
+            if worker_id is None:
+                worker_id = self._getWorkerID()
+            partitions = (
+                (self.LAST_PORT - self.FIRST_PORT) // self.PARTITION_SIZE)
+            self._first_port = (
+                self.FIRST_PORT +
+                (worker_id % partitions) * self.PARTITION_SIZE
+                )
+            self._next = 0
+            self._pid = pid
+        return self._first_port
+
+    def allocate(self, ip='127.0.0.1'):
+        """
+        Return a port from the worker range which can be bound on `ip`,
+        and keep it reserved until released.
+
+        Ports are handed out in turn, to avoid reusing a port which was
+        just closed.
+        """
+        with self._lock:
+            first_port = self._getFirstPort()
+            for _ in range(self.PARTITION_SIZE):
+                port = first_port + self._next
+                self._next = (self._next + 1) % self.PARTITION_SIZE
+                if port in self._reserved:
+                    continue
+                if not self._isFree(ip, port):
+                    continue
+                self._reserved.add(port)
+                self.allocated.append(port)
+                return port
+
+        raise AssertionError('No free port in %d-%d.' % (
+            first_port, first_port + self.PARTITION_SIZE - 1))
+
+    def release(self, port):
+        """
+        Make `port` available to be allocated again.
+        """
+        with self._lock:
+            self._reserved.discard(port)
+
+    def releaseAllocated(self, keep=0):
+        """
+        Release the ports allocated since the last call, other than the
+        first `keep` ports, which stay allocated.
+        """
+        with self._lock:
+            for port in self.allocated[keep:]:
+                self._reserved.discard(port)
+            del self.allocated[keep:]
+
+    @staticmethod
+    def _isFree(ip, port):
+        """
+        Return True if `port` can be bound on `ip`.
+        """
+        family = socket.AF_INET
+        if ':' in ip:
+            family = socket.AF_INET6
+        test_socket = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            test_socket.bind((ip, port))
+        except socket.error:
+            return False
+        finally:
+            test_socket.close()
+        return True
+
+
+# Allocator shared by all the tests from this process.
+allocator = PortAllocator()
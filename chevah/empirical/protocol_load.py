@@ -0,0 +1,174 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Helpers for measuring the throughput of protocols without real sockets.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from builtins import object
+import math
+import time
+
+from bunch import Bunch
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+
+class _TimedTransport(StringTransport):
+    """
+    StringTransport which informs the harness about each write.
+    """
+
+    def __init__(self, on_write):
+        StringTransport.__init__(self)
+        self._on_write = on_write
+
+    def write(self, data):
+        StringTransport.write(self, data)
+        self._on_write(self, data)
+
+
+class _Session(object):
+    """
+    A protocol and its transport, replaying the script.
+    """
+
+    def __init__(self, protocol, transport):
+        self.protocol = protocol
+        self.transport = transport
+        self.next_command = 0
+        self.sent_at = None
+
+
+class ProtocolLoadHarness(object):
+    """
+    Replay the same client commands into multiple protocols, connected to
+    in-memory transports, and measure the throughput.
+
+    Each command from `script` is sent to the protocol using
+    `dataReceived` only after the protocol has written a response for the
+    previous command, so each command should produce a response.
+    Data written by the protocol before the first command, like a
+    greeting, is not considered a response.
+
+    Usage::
+
+        harness = ProtocolLoadHarness(
+            test=self,
+            protocol_factory=lambda: factory.buildProtocol(address),
+            script=[b'USER test\r\n', b'PASS test\r\n', b'PWD\r\n'],
+            count=100,
+            )
+
+        result = harness.run(timeout=5)
+
+        self.assertLess(result.p99, 0.01)
+    """
+
+    def __init__(self, test, protocol_factory, script, count=1):
+        self._test = test
+        self._protocol_factory = protocol_factory
+        self._script = script
+        self._count = count
+        self._latencies = []
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._sessions = {}
+
+    def run(self, timeout=1):
+        """
+        Run the script for all protocols under executeReactor and return
+        the measurements.
+
+        The protocols are disconnected at the end of the run.
+        """
+        self._latencies = []
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        sessions = []
+        for _ in range(self._count):
+            transport = _TimedTransport(self._onWrite)
+            protocol = self._protocol_factory()
+            transport.protocol = protocol
+            session = _Session(protocol, transport)
+            self._sessions[id(transport)] = session
+            sessions.append(session)
+
+        start = time.time()
+        for session in sessions:
+            session.protocol.makeConnection(session.transport)
+            reactor.callLater(0, self._sendNext, session)
+
+        try:
+            self._test.executeReactor(timeout=timeout)
+        finally:
+            duration = time.time() - start
+            for session in sessions:
+                session.transport.loseConnection()
+                session.protocol.connectionLost(Failure(ConnectionDone()))
+            self._sessions = {}
+
+        return self._getResult(sessions, duration)
+
+    def _sendNext(self, session):
+        """
+        Send the next command from the script to `session`.
+        """
+        if session.next_command >= len(self._script):
+            return
+        data = self._script[session.next_command]
+        session.next_command += 1
+        self._bytes_sent += len(data)
+        session.sent_at = time.time()
+        session.protocol.dataReceived(data)
+
+    def _onWrite(self, transport, data):
+        """
+        Called when a protocol writes `data` to its `transport`.
+        """
+        self._bytes_received += len(data)
+        session = self._sessions.get(id(transport), None)
+        if session is None or session.sent_at is None:
+            # Not a response to a command.
+            return
+
+        self._latencies.append(time.time() - session.sent_at)
+        session.sent_at = None
+        reactor.callLater(0, self._sendNext, session)
+
+    def _getResult(self, sessions, duration):
+        """
+        Return the measurements for a run which took `duration` seconds.
+        """
+        latencies = sorted(self._latencies)
+        commands = len(latencies)
+        total_bytes = self._bytes_sent + self._bytes_received
+        if duration <= 0:
+            # Clock resolution is too low for the run.
+            duration = 1e-6
+
+        return Bunch(
+            duration=duration,
+            commands=commands,
+            bytes_sent=self._bytes_sent,
+            bytes_received=self._bytes_received,
+            commands_per_second=commands / duration,
+            bytes_per_second=total_bytes / duration,
+            p50=self._getPercentile(latencies, 0.5),
+            p99=self._getPercentile(latencies, 0.99),
+            transports=[session.transport for session in sessions],
+            )
+
+    @staticmethod
+    def _getPercentile(values, percentile):
+        """
+        Return the `percentile` from sorted `values`, using the nearest
+        rank method, or None when there are no values.
+        """
+        if not values:
+            return None
+        rank = int(math.ceil(percentile * len(values)))
+        return values[max(rank - 1, 0)]
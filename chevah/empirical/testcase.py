@@ -9,32 +9,27 @@ from __future__ import division
 from __future__ import absolute_import
 from builtins import next
 from builtins import str
-from builtins import range
 from builtins import object
 from contextlib import contextmanager
 from io import StringIO
+from queue import Queue
+import atexit
 import collections
+import errno
+import importlib
 import inspect
+import linecache
 import threading
 import os
+import re
+import select
+import signal
 import socket
 import sys
 import time
-
-from bunch import Bunch
-from mock import patch, Mock
-from nose import SkipTest
-try:
-    from twisted.internet.defer import Deferred
-    from twisted.internet.posixbase import (
-        _SocketWaker, _UnixWaker, _SIGCHLDWaker
-        )
-    from twisted.python.failure import Failure
-except ImportError:
-    # Twisted support is optional.
-    _SocketWaker = None
-    _UnixWaker = None
-    _SIGCHLDWaker = None
+import traceback
+import unittest
+import weakref
 
 from chevah.compat import (
     DefaultAvatar,
@@ -44,8 +39,10 @@ from chevah.compat import (
     SuperAvatar,
     )
 from chevah.empirical.mockup import factory
+from chevah.empirical.ports import allocator
 from chevah.empirical.constants import (
     TEST_NAME_MARKER,
+    WATCHDOG_THREAD_NAME,
     )
 
 # For Python below 2.7 we use the separate unittest2 module.
@@ -57,17 +54,275 @@ if sys.version_info[0:2] < (2, 7):
 else:
     from unittest import TestCase
 
-try:
-    from zope.interface.verify import verifyObject
-except ImportError:
-    # Zope support is optional.
-    pass
 
-try:
-    # Import reactor last in case some other modules are changing the reactor.
-    from twisted.internet import reactor
-except ImportError:
-    reactor = None
+# Names of the delayed calls, cached for each callable.
+_delayed_call_names = weakref.WeakKeyDictionary()
+# Matchers for the EXCEPTED_DELAYED_CALLS lists, cached for each list.
+_delayed_call_matchers = {}
+# Reports from instrumented reactor runs, consumed by the reactor usage
+# nose plugin.
+reactor_reports = collections.deque(maxlen=1000)
+
+
+class _LazyReactor(object):
+    """
+    Placeholder for the Twisted reactor, which is imported on first use.
+
+    This keeps Twisted out of the import time of this module and gives
+    the other modules a chance to install a different reactor.
+    """
+
+    def __getattr__(self, name):
+        return getattr(_get_reactor(), name)
+
+    def __setattr__(self, name, value):
+        setattr(_get_reactor(), name, value)
+
+    def __delattr__(self, name):
+        delattr(_get_reactor(), name)
+
+
+# Replaced by the real reactor, or None when Twisted is not available,
+# once _get_reactor is called.
+reactor = _LazyReactor()
+
+
+def _get_twisted(name):
+    """
+    Return the module `name` from the Twisted package, importing it on
+    first use.
+
+    Twisted is slow to import and is only needed by some tests.
+    """
+    return importlib.import_module('twisted.' + name)
+
+
+def _get_reactor():
+    """
+    Return the Twisted reactor, or None when Twisted is not available.
+    """
+    global reactor
+    if isinstance(reactor, _LazyReactor):
+        try:
+            twisted_reactor = _get_twisted('internet.reactor')
+        except ImportError:
+            # Twisted support is optional.
+            twisted_reactor = None
+        reactor = twisted_reactor
+    return reactor
+
+
+class _LazyClassAttribute(object):
+    """
+    Class attribute for which the value is created by calling `factory`
+    on first access.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._created = False
+
+    def __get__(self, instance, owner):
+        if not self._created:
+            self._value = self._factory()
+            self._created = True
+        return self._value
+
+
+def _get_excepted_readers():
+    """
+    Return the types of the readers added by the reactor itself.
+    """
+    try:
+        posixbase = _get_twisted('internet.posixbase')
+    except ImportError:
+        # Twisted support is optional.
+        return []
+    return [
+        posixbase._UnixWaker,
+        posixbase._SocketWaker,
+        posixbase._SIGCHLDWaker,
+        ]
+
+
+def _get_bunch():
+    """
+    Return the Bunch type.
+    """
+    from bunch import Bunch
+    return Bunch
+
+
+def _get_mock():
+    """
+    Return the Mock type.
+    """
+    from mock import Mock
+    return Mock
+
+
+def _get_patch():
+    """
+    Return the mock patch helper.
+    """
+    from mock import patch
+    return patch
+
+
+def _get_asyncio_loop():
+    """
+    Return the asyncio event loop used by the reactor, or None when the
+    reactor is not based on asyncio.
+    """
+    if _get_reactor() is None:
+        return None
+    return getattr(reactor, '_asyncioEventloop', None)
+
+
+def _get_asyncio_pending_tasks(loop):
+    """
+    Return the asyncio tasks from `loop` which are not done.
+    """
+    import asyncio
+    all_tasks = getattr(asyncio, 'all_tasks', None)
+    if all_tasks is None:
+        all_tasks = asyncio.Task.all_tasks
+    return [task for task in all_tasks(loop) if not task.done()]
+
+
+def _capture_stack(depth, skip=2):
+    """
+    Return the last `depth` frames from the stack of the caller, as a list
+    of (filename, line number, function name).
+
+    `skip` frames are ignored, starting with this function.
+    The source lines are only read when the stack is formatted.
+    """
+    stack = []
+    frame = sys._getframe(skip)
+    while frame is not None and len(stack) < depth:
+        code = frame.f_code
+        stack.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return stack
+
+
+def _format_stack(stack):
+    """
+    Return a text representation of a stack as returned by
+    `_capture_stack`, with the most recent frame last.
+    """
+    lines = []
+    for filename, line_number, name in reversed(stack):
+        lines.append('  File "%s", line %d, in %s' % (
+            filename, line_number, name))
+        source = linecache.getline(filename, line_number).strip()
+        if source:
+            lines.append('    %s' % (source,))
+    return '\n'.join(lines)
+
+
+def _get_monotonic_clock():
+    """
+    Return a function returning the number of seconds from a clock which
+    is not affected by changes of the system time.
+    """
+    monotonic = getattr(time, 'monotonic', None)
+    if monotonic is not None:
+        return monotonic
+    if os.name == 'posix':
+        # Elapsed real time, which is not affected by system time changes.
+        return lambda: os.times()[4]
+    if os.name == 'nt':
+        # On Windows it uses the performance counter.
+        return time.clock
+    return time.time
+
+
+_monotonic = _get_monotonic_clock()
+
+
+def _dump_threads():
+    """
+    Return the text with the stacks of all threads, other than the current
+    one.
+    """
+    frames = sys._current_frames()
+    current = threading.current_thread()
+    lines = []
+    for thread in threading.enumerate():
+        if thread is current:
+            continue
+        frame = frames.get(thread.ident, None)
+        if frame is None:
+            continue
+        lines.append('Thread %s:' % (thread.name,))
+        for line in traceback.format_stack(frame):
+            lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+class _Watchdog(object):
+    """
+    Calls a function from a separate thread when a deadline is reached.
+
+    A single daemon thread is started, on first use, and is reused for all
+    deadlines.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._deadline = None
+        self._on_timeout = None
+        self._thread = None
+
+    def arm(self, timeout, on_timeout):
+        """
+        Call `on_timeout` from the watchdog thread if not disarmed in
+        `timeout` seconds.
+        """
+        with self._condition:
+            self._deadline = _monotonic() + timeout
+            self._on_timeout = on_timeout
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=WATCHDOG_THREAD_NAME)
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._condition.notify()
+
+    def disarm(self):
+        """
+        Cancel the current deadline.
+        """
+        with self._condition:
+            self._deadline = None
+            self._on_timeout = None
+            self._condition.notify()
+
+    def _run(self):
+        """
+        Main loop of the watchdog thread.
+        """
+        with self._condition:
+            while True:
+                if self._deadline is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = self._deadline - _monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+
+                on_timeout = self._on_timeout
+                self._deadline = None
+                self._on_timeout = None
+                on_timeout()
+
+
+_watchdog = _Watchdog()
 
 
 def _get_hostname():
@@ -77,6 +332,84 @@ def _get_hostname():
     return socket.gethostname()
 
 
+# Results of a non-blocking connect which is not yet done.
+_CONNECT_IN_PROGRESS = (
+    0,
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    errno.EALREADY,
+    # WSAEWOULDBLOCK
+    10035,
+    )
+# Seconds to wait before probing again the addresses which have refused
+# the connection.
+_PROBE_RETRY_INTERVAL = 0.01
+
+
+def _probe_listening(addresses, timeout, retry=False):
+    """
+    Connect in parallel to all `addresses`, a list of (ip, port), and
+    return a dictionary with the local socket name for each address which
+    has accepted the connection in `timeout` seconds.
+
+    When `retry` is True, the addresses which have refused the connection
+    are probed again until accepted or until `timeout`.
+    """
+    deadline = _monotonic() + timeout
+    listening = {}
+    pending = {}
+    to_connect = list(addresses)
+    try:
+        while True:
+            refused = []
+            for address in to_connect:
+                family = socket.AF_INET
+                if ':' in address[0]:
+                    family = socket.AF_INET6
+                test_socket = socket.socket(family, socket.SOCK_STREAM)
+                test_socket.setblocking(False)
+                if test_socket.connect_ex(address) in _CONNECT_IN_PROGRESS:
+                    pending[test_socket] = address
+                else:
+                    test_socket.close()
+                    refused.append(address)
+
+            remaining = deadline - _monotonic()
+            if pending and remaining > 0:
+                wait = remaining
+                if retry and refused:
+                    wait = min(wait, _PROBE_RETRY_INTERVAL)
+                _, writable, failed = select.select(
+                    [], list(pending), list(pending), wait)
+                for test_socket in set(writable) | set(failed):
+                    address = pending.pop(test_socket)
+                    error = test_socket.getsockopt(
+                        socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error:
+                        refused.append(address)
+                    else:
+                        listening[address] = test_socket.getsockname()
+                        try:
+                            test_socket.shutdown(socket.SHUT_RDWR)
+                        except socket.error:
+                            # Already closed by the other side.
+                            pass
+                    test_socket.close()
+
+            remaining = deadline - _monotonic()
+            if not retry:
+                refused = []
+            if remaining <= 0 or not (pending or refused):
+                break
+            if refused and not pending:
+                time.sleep(min(remaining, _PROBE_RETRY_INTERVAL))
+            to_connect = refused
+    finally:
+        for test_socket in pending:
+            test_socket.close()
+    return listening
+
+
 class Contains(object):
     """
     Marker class used in tests when something needs to contain a value.
@@ -85,6 +418,796 @@ class Contains(object):
         self.value = value
 
 
+class _OutcomeRecorder(object):
+    """
+    Wrapper for a test method which records on the test case that the
+    method returned without errors.
+    """
+
+    def __init__(self, test, target):
+        self.__test = test
+        self.__target = target
+
+    def __call__(self):
+        result = self.__target()
+        self.__test._test_method_success = True
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.__target, name)
+
+
+def _get_delayed_call_matcher(names):
+    """
+    Return the cached matcher for the list of delayed call `names`.
+    """
+    names = tuple(names)
+    try:
+        return _delayed_call_matchers[names]
+    except KeyError:
+        matcher = _DelayedCallMatcher(names)
+        _delayed_call_matchers[names] = matcher
+        return matcher
+
+
+class _DelayedCallMatcher(object):
+    """
+    Match names of delayed calls against a list of names.
+
+    Exact names are looked up in a set, while substrings are matched
+    using a single regular expression which combines all names.
+    """
+
+    def __init__(self, names):
+        self._names = frozenset(names)
+        self._pattern = None
+        if self._names:
+            # Longer names first, so that the longest match is found.
+            alternatives = sorted(self._names, key=len, reverse=True)
+            self._pattern = re.compile(
+                u'|'.join(re.escape(name) for name in alternatives))
+
+    def isExact(self, name):
+        """
+        Return True if `name` is one of the names.
+        """
+        return name in self._names
+
+    def contains(self, name):
+        """
+        Return True if `name` contains any of the names.
+        """
+        if name in self._names:
+            return True
+        if self._pattern is None:
+            return False
+        return self._pattern.search(name) is not None
+
+
+class _ReactorInstrumentation(object):
+    """
+    Record the time spent by the reactor while running a test.
+
+    Delayed calls taking more than `slow_call` seconds are recorded
+    together with their duration.
+    For the last `size` iterations, the time spent in runUntilCurrent and
+    in doIteration, and the number of delayed calls which were executed,
+    are also recorded for each iteration.
+    """
+
+    def __init__(self, reactor, slow_call, size):
+        self._reactor = reactor
+        self._slow_call = slow_call
+        self.iterations = 0
+        self.run_until_current = 0
+        self.do_iteration = 0
+        self.delayed_calls = 0
+        self.slow_calls = []
+        # (run_until_current, do_iteration, delayed_calls) for each
+        # iteration.
+        self.iteration_times = collections.deque(maxlen=size)
+        self._current = (0, 0)
+
+    def runUntilCurrent(self):
+        """
+        Run the reactor's runUntilCurrent while timing the due delayed
+        calls.
+        """
+        now = self._reactor.seconds()
+        wrapped = []
+        for delayed_call in self._reactor.getDelayedCalls():
+            if not delayed_call.active() or delayed_call.getTime() > now:
+                continue
+            original = delayed_call.func
+            wrapper = self._wrap(original)
+            delayed_call.func = wrapper
+            wrapped.append((delayed_call, original, wrapper))
+
+        start = time.time()
+        delayed_calls = self.delayed_calls
+        try:
+            self._reactor.runUntilCurrent()
+        finally:
+            duration = time.time() - start
+            self.run_until_current += duration
+            self._current = (duration, self.delayed_calls - delayed_calls)
+            for delayed_call, original, wrapper in wrapped:
+                if delayed_call.func is wrapper:
+                    delayed_call.func = original
+
+    def doIteration(self, iterate, timeout):
+        """
+        Call `iterate` for the reactor while timing it.
+        """
+        start = time.time()
+        try:
+            iterate(timeout)
+        finally:
+            duration = time.time() - start
+            self.do_iteration += duration
+            self.iterations += 1
+            run_until_current, delayed_calls = self._current
+            self._current = (0, 0)
+            self.iteration_times.append(
+                (run_until_current, duration, delayed_calls))
+
+    def getReport(self, test_id):
+        """
+        Return the recorded data for test with `test_id`.
+        """
+        return _get_bunch()(
+            test_id=test_id,
+            iterations=self.iterations,
+            run_until_current=self.run_until_current,
+            do_iteration=self.do_iteration,
+            delayed_calls=self.delayed_calls,
+            slow_calls=self.slow_calls,
+            iteration_times=list(self.iteration_times),
+            )
+
+    def _wrap(self, func):
+        """
+        Return a wrapper recording the duration of calling `func`.
+        """
+        def timed_call(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.time() - start
+                self.delayed_calls += 1
+                if duration >= self._slow_call:
+                    name = TwistedTestCase._formatDelayedCallName(func)
+                    self.slow_calls.append((name, duration))
+        return timed_call
+
+
+class _ThreadPoolMonitor(object):
+    """
+    Keep track of the jobs sent to the reactor thread pool.
+
+    The reactor is woken each time a job is done, after its result was
+    sent to the reactor, so that the reactor can wait for the jobs
+    without polling the thread pool.
+    """
+
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self._lock = threading.Lock()
+        self._installed = False
+        self._previous = None
+        self.pending = 0
+
+    def install(self):
+        """
+        Start monitoring the current and future reactor thread pool.
+        """
+        self._installed = True
+        self._previous = self._reactor.__dict__.get('getThreadPool', None)
+        self._getThreadPool = self._reactor.getThreadPool
+        self._reactor.getThreadPool = self._getMonitoredThreadPool
+        if self._reactor.threadpool is not None:
+            self._watch(self._reactor.threadpool)
+
+    def uninstall(self):
+        """
+        Stop monitoring the reactor.
+
+        It does nothing when the monitor is not installed.
+        """
+        if not self._installed:
+            return
+        self._installed = False
+        if self._previous is None:
+            del self._reactor.getThreadPool
+        else:
+            self._reactor.getThreadPool = self._previous
+
+    def isWatching(self, threadpool):
+        """
+        Return True if jobs from `threadpool` are tracked.
+        """
+        return threadpool.__dict__.get('_empirical_monitor', None) is self
+
+    def _getMonitoredThreadPool(self):
+        """
+        Replacement for reactor.getThreadPool.
+        """
+        threadpool = self._getThreadPool()
+        self._watch(threadpool)
+        return threadpool
+
+    def _watch(self, threadpool):
+        """
+        Track all jobs which are sent to `threadpool`.
+        """
+        if '_empirical_monitor' not in threadpool.__dict__:
+            original = threadpool.callInThreadWithCallback
+
+            def callInThreadWithCallback(onResult, func, *args, **kwargs):
+                monitor = threadpool._empirical_monitor
+                return monitor._track(original, onResult, func, args, kwargs)
+
+            threadpool.callInThreadWithCallback = callInThreadWithCallback
+
+        threadpool._empirical_monitor = self
+
+    def _track(self, original, onResult, func, args, kwargs):
+        """
+        Send the job to the thread pool and call `_done` once its result
+        was handled.
+        """
+        with self._lock:
+            self.pending += 1
+
+        if onResult is None:
+            # Keep the thread pool behaviour of logging the errors for jobs
+            # without a result handler.
+            def job(*args, **kwargs):
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._done()
+            return original(None, job, *args, **kwargs)
+
+        def on_result(success, result):
+            try:
+                onResult(success, result)
+            finally:
+                self._done()
+        return original(on_result, func, *args, **kwargs)
+
+    def _done(self):
+        """
+        Called from the pool thread when a job is done.
+        """
+        with self._lock:
+            self.pending -= 1
+        self._reactor.wakeUp()
+
+
+class _ReactorTracker(object):
+    """
+    Keep track of the delayed calls, readers and writers which are added
+    to the reactor while the tracker is installed.
+
+    This allows checking and cleaning only what was added during a test.
+
+    When `stack_depth` is not 0, the last `stack_depth` frames of the
+    stack are recorded for each tracked object.
+    """
+
+    _METHODS = (
+        'callLater',
+        'addReader',
+        'addWriter',
+        'removeReader',
+        'removeWriter',
+        'removeAll',
+        )
+
+    # Inactive delayed calls are removed when the list grows beyond this
+    # size.
+    _PRUNE_SIZE = 1000
+
+    def __init__(self, reactor, stack_depth=0):
+        self._reactor = reactor
+        self._stack_depth = stack_depth
+        self._stacks = weakref.WeakKeyDictionary()
+        self._previous = {}
+        self._originals = {}
+        self._prune_size = self._PRUNE_SIZE
+        self.delayed_calls = []
+        self.readers = set()
+        self.writers = set()
+
+    def install(self):
+        """
+        Start tracking the reactor.
+        """
+        for name in self._METHODS:
+            self._previous[name] = self._reactor.__dict__.get(name, None)
+            self._originals[name] = getattr(self._reactor, name)
+            setattr(self._reactor, name, getattr(self, name))
+
+    def uninstall(self):
+        """
+        Stop tracking the reactor.
+
+        It does nothing when the tracker is not installed.
+        """
+        for name in self._METHODS:
+            if name not in self._previous:
+                continue
+            previous = self._previous.pop(name)
+            if previous is None:
+                delattr(self._reactor, name)
+            else:
+                setattr(self._reactor, name, previous)
+
+    def cancelDelayedCalls(self):
+        """
+        Cancel the tracked delayed calls which are still active.
+        """
+        for delayed_call in self.delayed_calls:
+            if delayed_call.active():
+                delayed_call.cancel()
+        self.delayed_calls = []
+
+    def getCreationStack(self, target):
+        """
+        Return the text of the stack from where `target` was added to the
+        reactor, or None when it was not recorded.
+        """
+        try:
+            stack = self._stacks.get(target, None)
+        except TypeError:
+            # Target can not be weak referenced.
+            return None
+        if stack is None:
+            return None
+        return _format_stack(stack)
+
+    def _record(self, target):
+        """
+        Record the stack of the caller which added `target`.
+        """
+        if not self._stack_depth:
+            return
+        try:
+            # Skip this method and the tracker method.
+            self._stacks[target] = _capture_stack(self._stack_depth, skip=3)
+        except TypeError:
+            # Target can not be weak referenced.
+            pass
+
+    def callLater(self, *args, **kwargs):
+        delayed_call = self._originals['callLater'](*args, **kwargs)
+        self._record(delayed_call)
+        self.delayed_calls.append(delayed_call)
+        if len(self.delayed_calls) > self._prune_size:
+            self.delayed_calls = [
+                call for call in self.delayed_calls if call.active()]
+            self._prune_size = max(
+                self._PRUNE_SIZE, len(self.delayed_calls) * 2)
+        return delayed_call
+
+    def addReader(self, reader):
+        result = self._originals['addReader'](reader)
+        self._record(reader)
+        self.readers.add(reader)
+        return result
+
+    def addWriter(self, writer):
+        result = self._originals['addWriter'](writer)
+        self._record(writer)
+        self.writers.add(writer)
+        return result
+
+    def removeReader(self, reader):
+        self.readers.discard(reader)
+        return self._originals['removeReader'](reader)
+
+    def removeWriter(self, writer):
+        self.writers.discard(writer)
+        return self._originals['removeWriter'](writer)
+
+    def removeAll(self):
+        self.readers.clear()
+        self.writers.clear()
+        return self._originals['removeAll']()
+
+
+class _ThreadTracker(object):
+    """
+    Keep track of the threads which are started while the tracker is
+    installed, together with the stack from where they were started.
+    """
+
+    def __init__(self, stack_depth):
+        self._stack_depth = stack_depth
+        self._previous = None
+        self.threads = []
+
+    def install(self):
+        """
+        Start tracking the threads.
+        """
+        self._previous = threading.Thread.__dict__['start']
+        previous = self._previous
+
+        def start(thread):
+            # Skip this function and the capture itself.
+            stack = _capture_stack(self._stack_depth, skip=2)
+            result = previous(thread)
+            self.threads.append((thread, stack))
+            return result
+
+        threading.Thread.start = start
+
+    def uninstall(self):
+        """
+        Stop tracking the threads.
+
+        It does nothing when the tracker is not installed.
+        """
+        if self._previous is None:
+            return
+        threading.Thread.start = self._previous
+        self._previous = None
+
+    def getAliveThreads(self, timeout, excepted_names):
+        """
+        Return the (thread, stack) for the tracked threads which are still
+        alive after waiting at most `timeout` seconds for all of them.
+
+        Threads with a name starting with any of `excepted_names` are
+        ignored.
+        """
+        deadline = _monotonic() + timeout
+        result = []
+        for thread, stack in self.threads:
+            if thread.getName().startswith(tuple(excepted_names)):
+                continue
+            thread.join(max(0, deadline - _monotonic()))
+            if thread.is_alive():
+                result.append((thread, stack))
+        return result
+
+
+class _Fixture(object):
+    """
+    A value shared between tests and the cleanup for releasing it.
+    """
+
+    def __init__(self, value, size, cleanup, test_id):
+        self.value = value
+        self.size = size
+        self.cleanup = cleanup
+        # The last test which has used this fixture.
+        self.test_id = test_id
+
+
+class _FixtureCache(object):
+    """
+    Fixtures shared between the tests of a class, a module or a session.
+
+    Fixtures are kept in the order in which they were used, so that the
+    least recently used ones can be released when the total size is over
+    the memory cap.
+    """
+
+    def __init__(self):
+        self._fixtures = collections.OrderedDict()
+
+    def get(self, key, test_id):
+        """
+        Return the fixture for `key` as used by `test_id`, or None.
+        """
+        fixture = self._fixtures.pop(key, None)
+        if fixture is None:
+            return None
+        fixture.test_id = test_id
+        # Move it last, as the most recently used one.
+        self._fixtures[key] = fixture
+        return fixture
+
+    def add(self, key, fixture):
+        """
+        Keep `fixture` for `key`.
+        """
+        self._fixtures[key] = fixture
+
+    def evict(self, memory_cap, test_id):
+        """
+        Forget the least recently used fixtures, which are not used by
+        `test_id`, until their total size is not over `memory_cap`.
+
+        Return the forgotten fixtures, so that they are released by the
+        current test.
+        """
+        total = sum(fixture.size for fixture in self._fixtures.values())
+        keys = []
+        for key, fixture in self._fixtures.items():
+            if total <= memory_cap:
+                break
+            if fixture.test_id == test_id:
+                continue
+            total -= fixture.size
+            keys.append(key)
+        return [self._fixtures.pop(key) for key in keys]
+
+    def release(self, scope=None, owner=None):
+        """
+        Release the fixtures for `scope` and `owner`, or all of them when
+        `scope` is None.
+
+        The cleanups are called as the cleanups of a separate test, so
+        that the deferreds returned by them are executed.
+        All cleanups are called, even when some of them fail, and the
+        errors are raised at the end.
+        """
+        keys = [
+            key for key in self._fixtures.keys()
+            if scope is None or key[:2] == (scope, owner)
+            ]
+        fixtures = [
+            fixture for fixture in
+            [self._fixtures.pop(key) for key in keys]
+            if fixture.cleanup is not None
+            ]
+        if not fixtures:
+            return
+
+        # The names generated by the current test are kept.
+        names = factory.popGeneratedNames()
+        result = unittest.TestResult()
+        try:
+            _FixtureRelease(fixtures).run(result)
+        finally:
+            factory.popGeneratedNames()
+            for name in names:
+                factory.recordGeneratedName(name)
+
+        errors = [trace for _, trace in result.errors + result.failures]
+        if errors:
+            raise AssertionError(
+                'Failed to release fixtures:\n%s' % ('\n'.join(errors),))
+
+
+def _releaseModuleFixtures(name):
+    """
+    Release the module fixtures for the module `name` at the end of its
+    tests, from the `tearDownModule` of the module, so that the errors are
+    reported for the module.
+
+    When tearDownModule is not called by the test runner, the fixtures are
+    released at the end of the session.
+    """
+    module = sys.modules.get(name, None)
+    if module is None:
+        return
+    previous = getattr(module, 'tearDownModule', None)
+    if getattr(previous, 'releases_fixtures', False):
+        return
+
+    def tearDownModule():
+        try:
+            if previous is not None:
+                previous()
+        finally:
+            _fixtures.release(scope='module', owner=name)
+
+    tearDownModule.releases_fixtures = True
+    module.tearDownModule = tearDownModule
+
+
+# Fixtures shared between tests.
+_fixtures = _FixtureCache()
+atexit.register(_fixtures.release)
+
+
+class _DeferredProfiler(object):
+    """
+    Record the time taken by each callback and errback of the watched
+    deferreds, and the number of reactor iterations between them.
+
+    Deferreds returned by the callbacks are also watched, one level
+    deeper.
+    """
+
+    def __init__(self, test):
+        self._test = test
+        self._ignored = []
+        self._last_end = None
+        self._last_iteration = 0
+        self.timeline = []
+
+    def ignore(self, function):
+        """
+        Don't record the calls to `function`.
+        """
+        self._ignored.append(function)
+
+    def watch(self, deferred, depth=0):
+        """
+        Record the callbacks which are and will be added to `deferred`.
+        """
+        if '_empirical_profiler_depth' in deferred.__dict__:
+            return
+        deferred._empirical_profiler_depth = depth
+
+        if self._last_end is None:
+            self._last_end = time.time()
+            self._last_iteration = self._test._reactor_iterations
+
+        deferred.callbacks = [
+            (self._wrap(callback, depth), self._wrap(errback, depth))
+            for callback, errback in deferred.callbacks
+            ]
+
+        add_callbacks = deferred.addCallbacks
+
+        def addCallbacks(
+                callback, errback=None,
+                callbackArgs=None, callbackKeywords=None,
+                errbackArgs=None, errbackKeywords=None):
+            if errback is None:
+                errback = _get_twisted('internet.defer').passthru
+            return add_callbacks(
+                self._wrapFunction(callback, depth),
+                self._wrapFunction(errback, depth),
+                callbackArgs=callbackArgs,
+                callbackKeywords=callbackKeywords,
+                errbackArgs=errbackArgs,
+                errbackKeywords=errbackKeywords,
+                )
+
+        deferred.addCallbacks = addCallbacks
+
+    def getTimeline(self):
+        """
+        Return the text for the recorded timeline, or an empty string when
+        nothing was recorded.
+        """
+        if not self.timeline:
+            return ''
+
+        lines = ['Deferred chain timeline:']
+        for entry in self.timeline:
+            lines.append(
+                '%s%s: %.6f seconds, after %.6f seconds and %d reactor '
+                'iterations' % (
+                    '  ' * (entry.depth + 1),
+                    entry.name,
+                    entry.duration,
+                    entry.waited,
+                    entry.iterations,
+                    ))
+        return '\n'.join(lines)
+
+    def _wrap(self, item, depth):
+        """
+        Wrap the function from a (function, args, kwargs) callbacks `item`.
+        """
+        function, args, kwargs = item
+        return (self._wrapFunction(function, depth), args, kwargs)
+
+    def _wrapFunction(self, function, depth):
+        """
+        Return a wrapper recording the calls to `function`.
+        """
+        defer = _get_twisted('internet.defer')
+        if not callable(function) or function is defer.passthru:
+            # Chained deferred marker or a link which does nothing.
+            return function
+        if function in self._ignored:
+            return function
+
+        Bunch = _get_bunch()
+
+        def profiled(result, *args, **kwargs):
+            start = time.time()
+            iteration = self._test._reactor_iterations
+            try:
+                new_result = function(result, *args, **kwargs)
+            finally:
+                end = time.time()
+                self.timeline.append(Bunch(
+                    name=TwistedTestCase._formatDelayedCallName(function),
+                    depth=depth,
+                    duration=end - start,
+                    waited=start - self._last_end,
+                    iterations=iteration - self._last_iteration,
+                    ))
+                self._last_end = end
+                self._last_iteration = iteration
+
+            if isinstance(new_result, defer.Deferred):
+                self.watch(new_result, depth=depth + 1)
+            return new_result
+
+        return profiled
+
+
+class _SynchronousThreadPool(object):
+    """
+    Replacement for the reactor thread pool which runs the jobs in the
+    reactor thread.
+
+    Jobs are sent to the reactor using callFromThread, so they are
+    executed in order, on the next reactor iteration, as if they were
+    called from a pool thread.
+    """
+
+    name = 'synchronous'
+    min = 0
+    max = 0
+
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self.q = Queue()
+        self.threads = []
+        self.working = []
+        self.started = True
+
+    def start(self):
+        """
+        Nothing to start.
+        """
+
+    def stop(self):
+        """
+        Nothing to stop.
+        """
+
+    def adjustPoolsize(self, minthreads=None, maxthreads=None):
+        """
+        Pool has no threads.
+        """
+
+    def callInThread(self, func, *args, **kwargs):
+        """
+        Call `func` in the reactor thread.
+        """
+        self.callInThreadWithCallback(None, func, *args, **kwargs)
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kwargs):
+        """
+        Call `func` in the reactor thread and call `onResult` with its
+        result.
+        """
+        self.q.put((onResult, func, args, kwargs))
+        self._reactor.callFromThread(self._runJob)
+
+    def _runJob(self):
+        """
+        Run the next job from the queue.
+        """
+        log = _get_twisted('python.log')
+        Failure = _get_twisted('python.failure').Failure
+        onResult, func, args, kwargs = self.q.get()
+        self.working.append(func)
+        try:
+            result = func(*args, **kwargs)
+            success = True
+        except BaseException:
+            result = Failure()
+            success = False
+        finally:
+            self.working.remove(func)
+
+        if onResult is None:
+            if not success:
+                log.err(result)
+            return
+
+        try:
+            onResult(success, result)
+        except BaseException:
+            log.err()
+
+
 class TwistedTestCase(TestCase):
     """
     Test case for Twisted specific code.
@@ -97,44 +1220,288 @@ class TwistedTestCase(TestCase):
     # required to wait for them when running the reactor.
     EXCEPTED_DELAYED_CALLS = []
 
-    EXCEPTED_READERS = [
-        _UnixWaker,
-        _SocketWaker,
-        _SIGCHLDWaker,
-        ]
+    EXCEPTED_READERS = _LazyClassAttribute(_get_excepted_readers)
+
+    # When True, runDeferred will block in the reactor until the next
+    # delayed call or until an event is received, instead of continuously
+    # polling the reactor while waiting for the deferred.
+    BLOCKING_REACTOR = False
+
+    # When True, the reactor will use a virtual clock which jumps straight
+    # to the next delayed call whenever there is no I/O ready, so that
+    # delayed calls take no wall time.
+    # The `timeout` for runDeferred and executeReactor is then measured in
+    # virtual time.
+    VIRTUAL_TIME = False
+
+    # Scope for which the reactor is kept running between runDeferred and
+    # executeReactor calls.
+    # None - the reactor is stopped at the end of each call.
+    # 'test' - the reactor is stopped at the end of each test.
+    # 'class' - the reactor is stopped after all tests from the class.
+    # The reactor is checked for leftovers only when it is stopped.
+    REACTOR_SESSION = None
+
+    # When True, the time spent by the reactor is recorded and a report
+    # is added to `reactor_reports` at the end of the test.
+    REACTOR_INSTRUMENTATION = False
+    # Delayed calls running for more than this number of seconds are
+    # reported as slow.
+    REACTOR_SLOW_CALL = 0.05
+    # Number of reactor iterations for which the time is recorded
+    # separately, in each test.
+    REACTOR_INSTRUMENTATION_SIZE = 1000
+
+    # When True, jobs sent to the reactor thread pool are executed in the
+    # reactor thread, without starting any pool threads.
+    SYNCHRONOUS_THREAD_POOL = False
+
+    # Number of reactor iterations kept in the trace, when running the
+    # reactor with `debug=True`.
+    # The trace is printed when the test fails or included in the timeout
+    # error.
+    REACTOR_TRACE_SIZE = 1000
+
+    # Number of seconds after which the test is interrupted, including
+    # setUp and tearDown. The time is measured on a monotonic clock, by a
+    # separate thread, so that tests blocked outside of the reactor are
+    # also interrupted.
+    # On timeout, the stacks of all threads are included in the failure.
+    # The test is only interrupted on POSIX, using SIGALRM, when running
+    # in the main thread. Elsewhere, the stacks are only written to
+    # stderr, as the main thread can not be interrupted without stopping
+    # the whole test run.
+    TEST_TIMEOUT = None
+
+    # When True, the time taken by each callback of the deferreds executed
+    # with runDeferred is recorded, together with the reactor iterations
+    # between callbacks.
+    # The timeline is included in the timeout error and is printed when
+    # the test fails.
+    DEFERRED_PROFILER = False
+
+    # Outcome of the test method, as recorded by run().
+    _test_method_success = None
+    # Tracker for what was added to the reactor during the test.
+    _reactor_tracker = None
+    _thread_pool_monitor = None
+    _synchronous_thread_pool = None
+    _virtual_time_offset = None
+
+    # When True, the stack from where each delayed call, reader or writer
+    # was added during the test is recorded and is included in the
+    # failure from assertReactorIsClean.
+    # Only the last REACTOR_LEAK_STACK_DEPTH frames are recorded.
+    REACTOR_LEAK_STACKS = False
+    REACTOR_LEAK_STACK_DEPTH = 8
 
     def setUp(self):
         super(TwistedTestCase, self).setUp()
         self._timeout_reached = False
         self._reactor_timeout_failure = None
+        self._virtual_time_offset = None
+        self._reactor_instrumentation = None
+        self._synchronous_thread_pool = None
+        self._reactor_trace = collections.deque(
+            maxlen=self.REACTOR_TRACE_SIZE)
+        self._reactor_iterations = 0
+        self._deferred_profiler = None
+        if self.DEFERRED_PROFILER:
+            self._deferred_profiler = _DeferredProfiler(self)
+            self._deferred_profiler.ignore(self._wakeTestReactor)
+        # The helpers get the reactor itself, and not the placeholder.
+        twisted_reactor = _get_reactor()
+        if twisted_reactor is not None:
+            if (self.SYNCHRONOUS_THREAD_POOL and
+                    twisted_reactor.threadpool is None):
+                self._synchronous_thread_pool = _SynchronousThreadPool(
+                    twisted_reactor)
+                twisted_reactor.threadpool = self._synchronous_thread_pool
+            self._thread_pool_monitor = _ThreadPoolMonitor(twisted_reactor)
+            self._thread_pool_monitor.install()
+            stack_depth = 0
+            if self.REACTOR_LEAK_STACKS:
+                stack_depth = self.REACTOR_LEAK_STACK_DEPTH
+            self._reactor_tracker = _ReactorTracker(
+                twisted_reactor, stack_depth=stack_depth)
+            self._reactor_tracker.install()
+            if self.REACTOR_INSTRUMENTATION:
+                self._reactor_instrumentation = _ReactorInstrumentation(
+                    twisted_reactor,
+                    slow_call=self.REACTOR_SLOW_CALL,
+                    size=self.REACTOR_INSTRUMENTATION_SIZE,
+                    )
+
+    def run(self, result=None):
+        """
+        Run the test while recording the outcome of the test method, so
+        that it is available in tearDown.
+        """
+        method_name = self._testMethodName
+        target = getattr(self, method_name, None)
+        if target is None:
+            return super(TwistedTestCase, self).run(result)
+
+        self._test_method_success = False
+        previous = self.__dict__.get(method_name, None)
+        setattr(self, method_name, _OutcomeRecorder(self, target))
+        stop_watchdog = None
+        if self.TEST_TIMEOUT:
+            stop_watchdog = self._startWatchdog(self.TEST_TIMEOUT)
+        try:
+            return super(TwistedTestCase, self).run(result)
+        finally:
+            # Disarm first, so that a late alarm is not raised from here.
+            if stop_watchdog is not None:
+                stop_watchdog()
+            # tearDown is not called when setUp fails.
+            self._restoreReactor()
+            if previous is None:
+                delattr(self, method_name)
+            else:
+                setattr(self, method_name, previous)
+
+    def _startWatchdog(self, timeout):
+        """
+        Interrupt the test if it does not finish in `timeout` seconds.
+
+        Without SIGALRM, the test is not interrupted and the timeout is
+        only reported on stderr.
+        The test is no longer interrupted once setUp fails or tearDown is
+        done, so that the alarm is not raised while the outcome of the test
+        is recorded.
+
+        Return the function which should be called to stop the watchdog.
+        """
+        state = {'armed': True, 'stacks': ''}
+        message = 'Test took more than %s seconds to execute.' % (timeout,)
+
+        def on_alarm(signum, frame):
+            if not state['armed']:
+                return
+            state['armed'] = False
+            raise AssertionError('%s\n%s' % (message, state['stacks']))
+
+        test_setUp = self.setUp
+        test_tearDown = self.tearDown
+
+        def setUp():
+            try:
+                return test_setUp()
+            except BaseException:
+                # The error is recorded next, without calling tearDown.
+                state['armed'] = False
+                raise
+
+        def tearDown():
+            try:
+                return test_tearDown()
+            finally:
+                state['armed'] = False
+
+        self.setUp = setUp
+        self.tearDown = tearDown
+
+        can_signal = (
+            getattr(signal, 'SIGALRM', None) is not None and
+            threading.current_thread().name == 'MainThread'
+            )
+        previous_handler = None
+        if can_signal:
+            previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+
+        def on_timeout():
+            stacks = _dump_threads()
+            state['stacks'] = stacks
+            sys.stderr.write('%s\n%s\n' % (message, stacks))
+            if not state['armed']:
+                return
+            if can_signal:
+                os.kill(os.getpid(), signal.SIGALRM)
+
+        def stop():
+            state['armed'] = False
+            _watchdog.disarm()
+            if can_signal:
+                signal.signal(signal.SIGALRM, previous_handler)
+            del self.setUp
+            del self.tearDown
+
+        _watchdog.arm(timeout, on_timeout)
+        return stop
 
     @property
     def _caller_success_member(self):
         """
-        Retrieve the 'success' member from the None test case.
+        Retrieve the success state of the test method.
         """
-        success = None
-        for i in range(2, 6):
-            try:
-                success = inspect.stack()[i][0].f_locals['success']
-                break
-            except KeyError:
-                success = None
-        if success is None:
+        if self._test_method_success is None:
             raise AssertionError('Failed to find "success" attribute.')
-        return success
+        return self._test_method_success
 
     def tearDown(self):
+        keep_reactor = False
+        is_clean = False
         try:
+            if not self._caller_success_member:
+                if self._reactor_trace:
+                    print(self._getReactorTrace())
+                if self._getDeferredTimeline():
+                    print(self._getDeferredTimeline())
+
+            if _get_reactor() is not None and self.REACTOR_SESSION == 'test':
+                self._stopTestReactor()
+
             if self._caller_success_member:
                 # Check for a clean reactor at shutdown, only if test
                 # passed.
                 self.assertIsNone(self._reactor_timeout_failure)
-                self.assertReactorIsClean()
+                if self.REACTOR_SESSION == 'class':
+                    # Reactor is checked at the end of the session.
+                    keep_reactor = True
+                else:
+                    self.assertReactorIsClean()
+                    is_clean = True
         finally:
-            self.cleanReactor()
+            if is_clean and self._reactor_tracker is not None:
+                # Only the excepted delayed calls are left.
+                self._reactor_tracker.cancelDelayedCalls()
+            elif not keep_reactor:
+                self.cleanReactor()
+            self._restoreReactor()
+            if self._reactor_instrumentation is not None:
+                reactor_reports.append(
+                    self._reactor_instrumentation.getReport(self.id()))
         super(TwistedTestCase, self).tearDown()
 
+    def _restoreReactor(self):
+        """
+        Remove the changes made to the reactor for the test.
+
+        It can be called multiple times.
+        """
+        self._stopVirtualTime()
+        if self._reactor_tracker is not None:
+            self._reactor_tracker.uninstall()
+        if self._thread_pool_monitor is not None:
+            self._thread_pool_monitor.uninstall()
+        pool = self._synchronous_thread_pool
+        if pool is not None and reactor.threadpool is pool:
+            reactor.threadpool = None
+
+    @classmethod
+    def tearDownClass(cls):
+        if _get_reactor() is not None and cls.REACTOR_SESSION == 'class':
+            try:
+                cls._stopTestReactor()
+                cls._checkReactorIsClean(
+                    excepted_readers=cls.EXCEPTED_READERS,
+                    excepted_delayed_calls=cls.EXCEPTED_DELAYED_CALLS,
+                    )
+            finally:
+                cls.cleanReactor()
+        super(TwistedTestCase, cls).tearDownClass()
+
     def _reactorQueueToString(self):
         """
         Return a string representation of all delayed calls from reactor
@@ -145,7 +1512,8 @@ class TwistedTestCase(TestCase):
             result.append(str(delayed.func))
         return '\n'.join(result)
 
-    def _threadPoolQueueSize(self):
+    @classmethod
+    def _threadPoolQueueSize(cls):
         """
         Return current size of thread Pool, or None when treadpool does not
         exists.
@@ -155,32 +1523,34 @@ class TwistedTestCase(TestCase):
         else:
             return reactor.threadpool.q.qsize()
 
-    def _threadPoolThreads(self):
+    @classmethod
+    def _threadPoolThreads(cls):
         """
-        Return current threads from pool, or None when treadpool does not
+        Return number of threads from pool, or 0 when treadpool does not
         exists.
         """
         if not reactor.threadpool:
             return 0
         else:
-            return reactor.threadpool.threads
+            return len(reactor.threadpool.threads)
 
-    def _threadPoolWorking(self):
+    @classmethod
+    def _threadPoolWorking(cls):
         """
-        Return working thread from pool, or None when treadpool does not
-        exists.
+        Return number of working threads from pool, or 0 when treadpool does
+        not exists.
         """
         if not reactor.threadpool:
             return 0
         else:
-            return reactor.threadpool.working
+            return len(reactor.threadpool.working)
 
     @classmethod
     def cleanReactor(cls):
         """
         Remove all delayed calls, readers and writers from the reactor.
         """
-        if not reactor:
+        if _get_reactor() is None:
             return
         try:
             reactor.removeAll()
@@ -195,14 +1565,21 @@ class TwistedTestCase(TestCase):
             if delayed_call.active():
                 delayed_call.cancel()
 
+        loop = _get_asyncio_loop()
+        if loop is not None:
+            for task in _get_asyncio_pending_tasks(loop):
+                task.cancel()
+
     def _raiseReactorTimeoutError(self, timeout):
         """
         Signal an timeout error while executing the reactor.
         """
         self._timeout_reached = True
-        failure = AssertionError(
-            'Reactor took more than %.2f seconds to execute.' % timeout)
-        self._reactor_timeout_failure = failure
+        message = 'Reactor took more than %.2f seconds to execute.' % timeout
+        trace = self._getReactorTrace()
+        if trace:
+            message += '\n' + trace
+        self._reactor_timeout_failure = AssertionError(message)
 
     def _initiateTestReactor(self, timeout=1):
         """
@@ -210,6 +1587,9 @@ class TwistedTestCase(TestCase):
         """
         self._timeout_reached = False
 
+        if self.VIRTUAL_TIME:
+            self._startVirtualTime()
+
         # Set up timeout.
         self._reactor_timeout_call = reactor.callLater(
             timeout, self._raiseReactorTimeoutError, timeout)
@@ -224,58 +1604,225 @@ class TwistedTestCase(TestCase):
         reactor._justStopped = False
         reactor.startRunning()
 
-    def _iterateTestReactor(self, debug=False):
+    def _iterateTestReactor(self, debug=False, wait=False):
         """
         Iterate the reactor.
+
+        When `wait` is True, it will block until the next delayed call is
+        due or until the reactor is woken by an event.
         """
-        reactor.runUntilCurrent()
+        self._reactor_iterations += 1
+        instrumentation = self._reactor_instrumentation
+        if instrumentation is None:
+            reactor.runUntilCurrent()
+        else:
+            instrumentation.runUntilCurrent()
+
+        if self._virtual_time_offset is not None:
+            self._advanceVirtualTime()
+
         if debug:
-            # When debug is enabled with iterate using a small delay in steps,
-            # to have a much better debug output.
-            # Otherwise the debug messages will flood the output.
-            print (
-                u'delayed: %s\n'
-                u'threads: %s\n'
-                u'writers: %s\n'
-                u'readers: %s\n'
-                u'threadpool size: %s\n'
-                u'threadpool threads: %s\n'
-                u'threadpool working: %s\n'
-                u'\n' % (
-                    self._reactorQueueToString(),
-                    reactor.threadCallQueue,
-                    reactor.getWriters(),
-                    reactor.getReaders(),
-                    self._threadPoolQueueSize(),
-                    self._threadPoolThreads(),
-                    self._threadPoolWorking(),
-                    )
-                )
-            t2 = reactor.timeout()
-            # For testing we want to force to reactor to wake at an
-            # interval of at most 1 second.
-            if t2 is None or t2 > 1:
-                t2 = 0.1
-            t = reactor.running and t2
-            reactor.doIteration(t)
+            # The trace is only shown when the test fails, so that the
+            # reactor is not slowed down by the debug output.
+            self._reactor_trace.append((
+                time.time(),
+                len(reactor.getDelayedCalls()),
+                len(reactor.threadCallQueue),
+                len(reactor.getWriters()),
+                len(reactor.getReaders()),
+                self._threadPoolQueueSize(),
+                self._threadPoolThreads(),
+                self._threadPoolWorking(),
+                ))
+
+        if wait:
+            t = self._getIterationTimeout()
+        else:
+            t = False
+
+        if instrumentation is None:
+            self._doTestReactorIteration(t)
+        else:
+            instrumentation.doIteration(self._doTestReactorIteration, t)
+
+    def _getReactorTrace(self):
+        """
+        Return the text for the reactor debug trace, or an empty string
+        when there is no trace.
+        """
+        if not self._reactor_trace:
+            return ''
+
+        start = self._reactor_trace[0][0]
+        lines = [
+            'Reactor trace for last %d iterations:' % (
+                len(self._reactor_trace),),
+            ]
+        for record in self._reactor_trace:
+            lines.append(
+                '%.6f delayed=%d threads=%d writers=%d readers=%d '
+                'pool_queue=%d pool_threads=%d pool_working=%d' % (
+                    (record[0] - start,) + record[1:]))
+        return '\n'.join(lines)
+
+    def _getDeferredTimeline(self):
+        """
+        Return the text for the deferred profiler timeline, or an empty
+        string when the profiler is not enabled or nothing was recorded.
+        """
+        if self._deferred_profiler is None:
+            return ''
+        return self._deferred_profiler.getTimeline()
+
+    def _doTestReactorIteration(self, timeout):
+        """
+        Wait for at most `timeout` seconds for events and handle them.
+
+        The asyncio event loop can not wait for a single iteration, so it
+        runs and handles events until `timeout` or until it is woken by
+        `_wakeTestReactor`.
+        """
+        loop = _get_asyncio_loop()
+        if loop is None:
+            reactor.doIteration(timeout)
+            return
+
+        if not timeout:
+            # A stopped loop will run all ready callbacks and then return.
+            loop.stop()
+            loop.run_forever()
+            return
+
+        stop_call = loop.call_later(timeout, loop.stop)
+        try:
+            loop.run_forever()
+        finally:
+            stop_call.cancel()
+
+    def _getIterationTimeout(self):
+        """
+        Return the number of seconds for which the reactor can wait for
+        events without missing a delayed call.
+        """
+        if not reactor.running:
+            return False
+
+        timeout = reactor.timeout()
+        # Don't wait forever when there are no delayed calls.
+        if timeout is None or timeout > 1:
+            return 1
+        # Pollers have a millisecond resolution and will round down, so
+        # we add a millisecond to not wake before the delayed call is due.
+        return timeout + 0.001
+
+    def _startVirtualTime(self):
+        """
+        Replace the reactor clock with a virtual clock.
+
+        The virtual clock starts at the current time so that delayed calls
+        created before it was started are still valid.
+        """
+        if self._virtual_time_offset is not None:
+            return
+        self._virtual_time_offset = 0
+        self._real_seconds = reactor.seconds
+        reactor.seconds = self._getVirtualSeconds
+
+    def _stopVirtualTime(self):
+        """
+        Restore the reactor clock.
+        """
+        if self._virtual_time_offset is None:
+            return
+        del reactor.seconds
+        self._virtual_time_offset = None
+
+    def _getVirtualSeconds(self):
+        """
+        Return the current time, as seen by the virtual clock.
+        """
+        return self._real_seconds() + self._virtual_time_offset
+
+    def _advanceVirtualTime(self):
+        """
+        Move the virtual clock to the next delayed call, when the reactor
+        has nothing else to do.
+        """
+        if reactor.threadCallQueue:
+            return
+
+        if self._threadPoolWorking() or self._threadPoolQueueSize():
+            return
+
+        if reactor.getWriters() or self._isReactorIOReady():
+            return
+
+        now = reactor.seconds()
+        next_call = None
+        matcher = self._getExceptedDelayedCallsMatcher()
+        for delayed_call in reactor.getDelayedCalls():
+            if not delayed_call.active():
+                continue
+            if self._isExceptedDelayedCall(delayed_call, matcher):
+                continue
+            if next_call is None or delayed_call.time < next_call:
+                next_call = delayed_call.time
+
+        if next_call is not None and next_call > now:
+            self._virtual_time_offset += next_call - now
+
+    def _isReactorIOReady(self):
+        """
+        Return True if any reader from the reactor has data ready.
+        """
+        readers = reactor.getReaders()
+        if not readers:
+            return False
+        try:
+            ready, _, _ = select.select(readers, [], [], 0)
+        except (select.error, ValueError, TypeError):
+            # We can not tell, so we assume there is something to read.
+            return True
+        return bool(ready)
+
+    def _wakeTestReactor(self, result):
+        """
+        Callback used to wake the reactor, which might be blocked waiting
+        for events.
+        """
+        loop = _get_asyncio_loop()
+        if loop is None:
+            reactor.wakeUp()
         else:
-            reactor.doIteration(False)
+            loop.stop()
+        return result
 
     def _shutdownTestReactor(self, prevent_stop=False):
         """
         Called at the end of a test reactor run.
 
-        When prevent_stop=True, the reactor will not be stopped.
+        When prevent_stop=True or when running a reactor session, the
+        reactor will not be stopped.
         """
         if not self._timeout_reached:
             # Everything fine, disable timeout.
             if not self._reactor_timeout_call.cancelled:
                 self._reactor_timeout_call.cancel()
 
-        if prevent_stop:
+        if prevent_stop or self.REACTOR_SESSION:
             # Don't continue with stop procedure.
             return
 
+        self._stopTestReactor()
+
+    @classmethod
+    def _stopTestReactor(cls):
+        """
+        Stop the reactor and reset it so that it can be started again.
+        """
+        if not reactor._started:
+            return
+
         # Let the reactor know that we want to stop reactor.
         reactor.stop()
         # Let the reactor run one more time to execute the stop code.
@@ -294,13 +1841,61 @@ class TwistedTestCase(TestCase):
     def assertReactorIsClean(self):
         """
         Check that the reactor has no delayed calls, readers or writers.
+
+        Only the delayed calls, readers and writers which were added
+        during the test are checked.
         """
-        if reactor is None:
+        tracker = self._reactor_tracker
+        if tracker is None:
+            self._checkReactorIsClean(
+                excepted_readers=self.EXCEPTED_READERS,
+                excepted_delayed_calls=self.EXCEPTED_DELAYED_CALLS,
+                )
             return
 
-        def raise_failure(location, reason):
-            raise AssertionError(
-                'Reactor is not clean. %s: %s' % (location, reason))
+        self._checkReactorIsClean(
+            excepted_readers=self.EXCEPTED_READERS,
+            excepted_delayed_calls=self.EXCEPTED_DELAYED_CALLS,
+            readers=tracker.readers,
+            writers=tracker.writers,
+            delayed_calls=tracker.delayed_calls,
+            get_creation_stack=tracker.getCreationStack,
+            )
+
+    @classmethod
+    def _checkReactorIsClean(
+            cls, excepted_readers, excepted_delayed_calls,
+            readers=None, writers=None, delayed_calls=None,
+            get_creation_stack=None,
+            ):
+        """
+        Raise an AssertionError if the reactor has delayed calls, readers
+        or writers, other than the excepted ones.
+
+        When `readers`, `writers` or `delayed_calls` are not provided, all
+        the ones from the reactor are checked.
+
+        `get_creation_stack` is called with the leaked object, and should
+        return the text of the stack from where it was created or None.
+        """
+        if _get_reactor() is None:
+            return
+
+        if readers is None:
+            readers = reactor.getReaders()
+        if writers is None:
+            writers = reactor.getWriters()
+        if delayed_calls is None:
+            delayed_calls = reactor.getDelayedCalls()
+
+        def raise_failure(location, reason, target=None):
+            message = 'Reactor is not clean. %s: %s' % (location, reason)
+            stack = None
+            if target is not None and get_creation_stack is not None:
+                stack = get_creation_stack(target)
+            if stack:
+                message += '\nCreated at:\n%s' % (stack,)
+            raise AssertionError(message)
 
         if reactor._started:
             raise AssertionError('Reactor was not stopped.')
@@ -309,33 +1904,42 @@ class TwistedTestCase(TestCase):
         if len(reactor.threadCallQueue) > 0:
             raise_failure('threads', reactor.threadCallQueue)
 
-        if self._threadPoolQueueSize() > 0:
-            raise_failure('threadpoool queue', self._threadPoolQueueSize())
+        if cls._threadPoolQueueSize() > 0:
+            raise_failure('threadpoool queue', cls._threadPoolQueueSize())
 
-        if self._threadPoolWorking() > 0:
-            raise_failure('threadpoool working', self._threadPoolWorking())
+        if cls._threadPoolWorking() > 0:
+            raise_failure('threadpoool working', cls._threadPoolWorking())
 
-        if self._threadPoolThreads() > 0:
-            raise_failure('threadpoool threads', self._threadPoolThreads())
+        if cls._threadPoolThreads() > 0:
+            raise_failure('threadpoool threads', cls._threadPoolThreads())
 
-        if len(reactor.getWriters()) > 0:
-            raise_failure('writers', str(reactor.getWriters()))
+        if len(writers) > 0:
+            raise_failure(
+                'writers', str(list(writers)), target=next(iter(writers)))
 
-        for reader in reactor.getReaders():
+        for reader in readers:
             excepted = False
-            for reader_type in self.EXCEPTED_READERS:
+            for reader_type in excepted_readers:
                 if isinstance(reader, reader_type):
                     excepted = True
                     break
             if not excepted:
-                raise_failure('readers', str(reactor.getReaders()))
+                raise_failure('readers', str(list(readers)), target=reader)
 
-        for delayed_call in reactor.getDelayedCalls():
+        matcher = _get_delayed_call_matcher(excepted_delayed_calls)
+        for delayed_call in delayed_calls:
             if delayed_call.active():
-                delayed_str = self._getDelayedCallName(delayed_call)
-                if delayed_str in self.EXCEPTED_DELAYED_CALLS:
+                delayed_str = cls._getDelayedCallName(delayed_call)
+                if matcher.isExact(delayed_str):
                     continue
-                raise_failure('delayed calls', delayed_str)
+                raise_failure(
+                    'delayed calls', delayed_str, target=delayed_call)
+
+        loop = _get_asyncio_loop()
+        if loop is not None:
+            pending_tasks = _get_asyncio_pending_tasks(loop)
+            if pending_tasks:
+                raise_failure('asyncio tasks', str(pending_tasks))
 
     def runDeferred(
             self, deferred, timeout=1, debug=False, prevent_stop=False):
@@ -345,6 +1949,10 @@ class TwistedTestCase(TestCase):
         Starts the reactor, waits for deferred execution,
         raises error in timeout, stops the reactor.
 
+        `deferred` can also be a coroutine or an asyncio future, in which
+        case it is converted to a deferred.
+        Returns the deferred which was executed.
+
         This will do recursive calls, in case the original deferred returns
         another deferred.
 
@@ -362,8 +1970,7 @@ class TwistedTestCase(TestCase):
             self.assertIsNotFailure(deferred)
             self.assertEqual('something', deferred.result)
         """
-        if not isinstance(deferred, Deferred):
-            raise AssertionError('This is not a deferred.')
+        deferred = self._getDeferred(deferred)
 
         try:
             self._initiateTestReactor(timeout=timeout)
@@ -371,24 +1978,76 @@ class TwistedTestCase(TestCase):
         finally:
             self._shutdownTestReactor(
                 prevent_stop=prevent_stop)
+        return deferred
+
+    def _getDeferred(self, target):
+        """
+        Return the deferred for `target`, which can be a deferred, a
+        coroutine or an asyncio future.
+        """
+        defer = _get_twisted('internet.defer')
+        if isinstance(target, defer.Deferred):
+            return target
+
+        loop = _get_asyncio_loop()
+        # There can be no asyncio futures when asyncio was not imported.
+        asyncio = sys.modules.get('asyncio', None)
+        if asyncio is not None and isinstance(target, asyncio.Future):
+            if loop is None:
+                raise AssertionError(
+                    'asyncio futures can only be used with the asyncio '
+                    'reactor.')
+            return defer.Deferred.fromFuture(target)
+
+        iscoroutine = getattr(inspect, 'iscoroutine', None)
+        if iscoroutine is not None and iscoroutine(target):
+            if loop is not None:
+                # Run it as an asyncio task, so that it can also wait for
+                # asyncio futures.
+                return defer.Deferred.fromFuture(
+                    asyncio.ensure_future(target, loop=loop))
+            ensureDeferred = getattr(defer, 'ensureDeferred', None)
+            if ensureDeferred is None:
+                raise AssertionError(
+                    'Coroutines are not supported by this Twisted version.')
+            return ensureDeferred(target)
+
+        raise AssertionError('This is not a deferred.')
 
     def _runDeferred(self, deferred, timeout, debug):
         """
         Does the actual deferred execution.
         """
+        defer = _get_twisted('internet.defer')
+        if self._deferred_profiler is not None:
+            self._deferred_profiler.watch(deferred)
+
         if not deferred.called:
+            wait = self.BLOCKING_REACTOR
+            if wait:
+                # The deferred might be called from outside of the reactor
+                # loop, so make sure the reactor is not left waiting.
+                deferred.addBoth(self._wakeTestReactor)
+
             deferred_done = False
             while not deferred_done:
-                self._iterateTestReactor(debug=debug)
+                self._iterateTestReactor(debug=debug, wait=wait)
                 deferred_done = deferred.called
 
                 if self._timeout_reached:
-                    raise AssertionError(
+                    message = (
                         'Deferred took more than %d to execute.' % timeout)
+                    trace = self._getReactorTrace()
+                    if trace:
+                        message += '\n' + trace
+                    timeline = self._getDeferredTimeline()
+                    if timeline:
+                        message += '\n' + timeline
+                    raise AssertionError(message)
 
         # Check executing all deferred from chained callbacks.
         result = deferred.result
-        while isinstance(result, Deferred):
+        while isinstance(result, defer.Deferred):
             self._runDeferred(result, timeout=timeout, debug=debug)
             result = deferred.result
 
@@ -423,22 +2082,32 @@ class TwistedTestCase(TestCase):
 
         # Set it to True to enter the first loop.
         have_callbacks = True
+        wait = False
         while have_callbacks and not self._timeout_reached:
-            self._iterateTestReactor(debug=debug)
+            self._iterateTestReactor(debug=debug, wait=wait)
 
             have_callbacks = False
+            wait = False
 
             # Check for active jobs in thread pool.
-            if reactor.threadpool:
-                if (
-                        reactor.threadpool.working or
-                        (reactor.threadpool.q.qsize() > 0)
-                        ):
+            if self._thread_pool_monitor.pending:
+                # The reactor is woken when a job is done, so we can wait.
+                wait = True
+                have_callbacks = True
+                continue
+
+            threadpool = reactor.threadpool
+            if threadpool and not self._thread_pool_monitor.isWatching(
+                    threadpool):
+                # Jobs from a pool which is not monitored can only be
+                # polled.
+                if threadpool.working or (threadpool.q.qsize() > 0):
                     time.sleep(0.01)
                     have_callbacks = True
                     continue
 
             # Look at delayed calls.
+            matcher = self._getExceptedDelayedCallsMatcher()
             for delayed in reactor.getDelayedCalls():
                 # We skip our own timeout call.
                 if delayed is self._reactor_timeout_call:
@@ -446,12 +2115,7 @@ class TwistedTestCase(TestCase):
                 if not delayed.func:
                     # Was already called.
                     continue
-                delayed_str = self._getDelayedCallName(delayed)
-                is_exception = False
-                for excepted_callback in self.EXCEPTED_DELAYED_CALLS:
-                    if excepted_callback in delayed_str:
-                        is_exception = True
-                if not is_exception:
+                if not self._isExceptedDelayedCall(delayed, matcher):
                     # No need to look for other delayed calls.
                     have_callbacks = True
                     break
@@ -492,11 +2156,54 @@ class TwistedTestCase(TestCase):
 
         self._shutdownTestReactor()
 
-    def _getDelayedCallName(self, delayed_call):
+    def _getExceptedDelayedCallsMatcher(self):
+        """
+        Return the matcher for the current EXCEPTED_DELAYED_CALLS.
+        """
+        return _get_delayed_call_matcher(self.EXCEPTED_DELAYED_CALLS)
+
+    def _isExceptedDelayedCall(self, delayed_call, matcher):
+        """
+        Return True if we don't need to wait for the delayed call.
+        """
+        return matcher.contains(self._getDelayedCallName(delayed_call))
+
+    @classmethod
+    def _getDelayedCallName(cls, delayed_call):
         """
         Return a string representation of the delayed call.
+
+        The name is cached for each callable, since converting a bound
+        method to string also converts its instance.
         """
-        raw_name = str(delayed_call.func)
+        func = delayed_call.func
+        target = getattr(func, '__func__', func)
+        owner = getattr(func, '__self__', None)
+        if owner is not None:
+            owner = owner.__class__
+
+        try:
+            names = _delayed_call_names[target]
+        except KeyError:
+            names = {}
+            _delayed_call_names[target] = names
+        except TypeError:
+            # Callable can not be weak referenced.
+            return cls._formatDelayedCallName(func)
+
+        try:
+            return names[owner]
+        except KeyError:
+            name = cls._formatDelayedCallName(func)
+            names[owner] = name
+            return name
+
+    @staticmethod
+    def _formatDelayedCallName(func):
+        """
+        Return the name of the delayed call `func`.
+        """
+        raw_name = str(func)
         raw_name = raw_name.replace('<function ', '')
         raw_name = raw_name.replace('<bound method ', '')
         return raw_name.split(' ', 1)[0]
@@ -516,7 +2223,7 @@ class TwistedTestCase(TestCase):
 
             self.assertFailureType(AuthenticationError, failure)
         """
-        self.runDeferred(
+        deferred = self.runDeferred(
             deferred,
             timeout=timeout,
             debug=debug,
@@ -547,6 +2254,7 @@ class TwistedTestCase(TestCase):
 
         @return: The result of C{deferred}.
         """
+        Failure = _get_twisted('python.failure').Failure
         # FIXME:1370:
         # Remove / re-route this code after upgrading to Twisted 13.0.
         result = []
@@ -588,6 +2296,7 @@ class TwistedTestCase(TestCase):
         @return: The failure result of C{deferred}.
         @rtype: L{failure.Failure}
         """
+        Failure = _get_twisted('python.failure').Failure
         # FIXME:1370:
         # Remove / re-route this code after upgrading to Twisted 13
         result = []
@@ -664,7 +2373,7 @@ class TwistedTestCase(TestCase):
 
             self.assertEqual('something', result)
         """
-        self.runDeferred(
+        deferred = self.runDeferred(
             deferred,
             timeout=timeout,
             debug=debug,
@@ -673,6 +2382,62 @@ class TwistedTestCase(TestCase):
         self.assertIsNotFailure(deferred)
         return deferred.result
 
+    def getDeferredResults(
+            self, deferreds, timeout=1, debug=False, prevent_stop=False):
+        """
+        Run all deferreds in a single reactor run and return their results.
+
+        Coroutines and asyncio futures are also accepted, as in
+        `runDeferred`.
+
+        Return a list with a `(success, result, latency)` tuple for each
+        deferred, in the same order as `deferreds`.
+        For failed deferreds, `success` is False and `result` is the
+        failure, which is not raised.
+        `latency` is the number of seconds, as measured by the reactor,
+        from the start of the run until the deferred got its result.
+
+        Usage::
+
+            deferreds = [client.get(path) for path in paths]
+
+            results = self.getDeferredResults(deferreds)
+
+            for success, result, latency in results:
+                self.assertTrue(success)
+                self.assertLess(latency, 0.5)
+        """
+        Failure = _get_twisted('python.failure').Failure
+        deferreds = [self._getDeferred(deferred) for deferred in deferreds]
+        completed = {}
+
+        def record_completion(result, index):
+            completed[index] = reactor.seconds()
+            return result
+
+        if self._deferred_profiler is not None:
+            self._deferred_profiler.ignore(record_completion)
+
+        try:
+            self._initiateTestReactor(timeout=timeout)
+            start = reactor.seconds()
+            for index, deferred in enumerate(deferreds):
+                deferred.addBoth(record_completion, index)
+
+            for deferred in deferreds:
+                self._runDeferred(deferred, timeout, debug=debug)
+        finally:
+            self._shutdownTestReactor(prevent_stop=prevent_stop)
+
+        results = []
+        for index, deferred in enumerate(deferreds):
+            result = deferred.result
+            success = not isinstance(result, Failure)
+            if not success:
+                self.ignoreFailure(deferred)
+            results.append((success, result, completed[index] - start))
+        return results
+
     def assertWasCalled(self, deferred):
         """
         Check that deferred was called.
@@ -693,6 +2458,7 @@ class TwistedTestCase(TestCase):
         """
         Check that deferred is a failure.
         """
+        Failure = _get_twisted('python.failure').Failure
         if not isinstance(deferred.result, Failure):
             raise AssertionError('Deferred is not a failure.')
 
@@ -703,6 +2469,7 @@ class TwistedTestCase(TestCase):
         The failed deferred is handled by this method, to avoid propagating
         the error into the reactor.
         """
+        Failure = _get_twisted('python.failure').Failure
         self.assertWasCalled(deferred)
 
         if isinstance(deferred.result, Failure):
@@ -724,46 +2491,206 @@ class ChevahTestCase(TwistedTestCase):
 
     # We assume that hostname does not change during test and this
     # should save a few DNS queries.
-    hostname = _get_hostname()
+    hostname = _LazyClassAttribute(_get_hostname)
 
-    Bunch = Bunch
+    Bunch = _LazyClassAttribute(_get_bunch)
     Contains = Contains
-    Mock = Mock
+    Mock = _LazyClassAttribute(_get_mock)
     #: Obsolete. Please use self.patch and self.patchObject.
-    Patch = patch
+    Patch = _LazyClassAttribute(_get_patch)
+
+    # When True, the whole temporary and working folders are scanned for
+    # test files at the end of each test, instead of only checking the
+    # names generated by the factory during the test.
+    SCAN_TEMPORARY_FOLDERS = False
+
+    # Prefixes for the names of the threads which can still run at the
+    # end of the test.
+    EXCEPTED_THREADS = [
+        'threaded_reactor',
+        WATCHDOG_THREAD_NAME,
+        'PoolThread-twisted.internet.reactor',
+        ]
+    # Seconds to wait for the threads started by the test to stop, before
+    # considering them leaked.
+    THREAD_JOIN_TIMEOUT = 0.5
+    THREAD_LEAK_STACK_DEPTH = 8
+
+    # Seconds to wait for the deferreds returned by the cleanup methods.
+    CLEANUP_TIMEOUT = 5
+
+    # Maximum size in kilo bytes of the fixtures shared between tests.
+    # When over, the least recently used fixtures are released.
+    FIXTURE_MEMORY_CAP = 256 * 1024
 
     _environ_user = None
     _drop_user = '-'
+    _thread_tracker = None
+    # Number of ports allocated before the test.
+    _ports_start = None
+    # Maximum memory usage of the process, recorded before resetting the
+    # peak memory usage.
+    _peak_memory_before_reset = 0
 
     def setUp(self):
         super(ChevahTestCase, self).setUp()
         self.__cleanup__ = []
+        self._test_fixtures = {}
         self.test_segments = None
+        self._thread_tracker = _ThreadTracker(
+            stack_depth=self.THREAD_LEAK_STACK_DEPTH)
+        self._thread_tracker.install()
+        # Names generated outside of the test are not checked.
+        factory.popGeneratedNames()
+        # Ports allocated outside of the test are kept reserved.
+        self._ports_start = len(allocator.allocated)
+
+    def run(self, result=None):
+        try:
+            return super(ChevahTestCase, self).run(result)
+        finally:
+            # tearDown is not called when setUp fails.
+            if self._thread_tracker is not None:
+                self._thread_tracker.uninstall()
+            if self._ports_start is not None:
+                allocator.releaseAllocated(keep=self._ports_start)
 
     def tearDown(self):
-        self.callCleanup()
-        self._checkTemporaryFiles()
-        threads = threading.enumerate()
-        if len(threads) > 1:
-            # FIXME:1077:
-            # For now we don't clean the whole reactor so Twisted is
-            # an exception here.
-            for thread in threads:
-                thread_name = thread.getName()
-                if thread_name == 'MainThread':
-                    continue
-                if thread_name == 'threaded_reactor':
-                    continue
-                if thread_name.startswith(
-                        'PoolThread-twisted.internet.reactor'):
-                    continue
+        success = False
+        try:
+            try:
+                self.callCleanup()
+                self._checkTemporaryFiles()
+            finally:
+                self._thread_tracker.uninstall()
+            self._checkThreads()
+            success = True
+        finally:
+            allocator.releaseAllocated(keep=self._ports_start)
+            if not success:
+                # The reactor is still cleaned and restored, but it is not
+                # checked, so that the error from above is not hidden.
+                self._test_method_success = False
+            super(ChevahTestCase, self).tearDown()
 
-                raise AssertionError(
-                    'There are still active threads, '
-                    'beside the main thread: %s - %s' % (
-                        thread_name, threads))
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            _fixtures.release(scope='class', owner=cls)
+        finally:
+            super(ChevahTestCase, cls).tearDownClass()
+
+    @classmethod
+    def releaseFixtures(cls):
+        """
+        Release all the fixtures shared between tests.
+
+        This is called at the end of the test session.
+        """
+        _fixtures.release()
+
+    def fixture(self, create, scope='test', cleanup=None, key=None,
+                size=None):
+        """
+        Return the value created by calling `create`, shared by all the
+        tests from `scope`.
+
+        `scope` is one of 'test', 'class', 'module' or 'session'.
+        `cleanup` is called with the value at the end of the scope, or at
+        the end of the test which evicted the fixture, as a test cleanup.
+        When it returns a deferred, the deferred is executed as for the
+        other cleanups.
+        `key` identifies the fixture, and is `create` by default.
+        `size` is the memory used by the value, in kilo bytes.
+        When not provided, it is the memory usage increase while calling
+        `create`.
+
+        Files, threads and ports created by `create` for a fixture which is
+        not for a single test are not checked or released at the end of
+        the test.
+
+        Usage::
+
+            def setUp(self):
+                super(TestSomething, self).setUp()
+                self.context = self.fixture(
+                    mk.makeSSLContext, scope='class')
+        """
+        if key is None:
+            key = getattr(create, '__func__', create)
+
+        if scope == 'test':
+            if key not in self._test_fixtures:
+                self._test_fixtures[key] = create()
+                if cleanup is not None:
+                    self.addCleanup(cleanup, self._test_fixtures[key])
+            return self._test_fixtures[key]
+
+        owners = {
+            'class': self.__class__,
+            'module': self.__class__.__module__,
+            'session': None,
+            }
+        if scope not in owners:
+            raise AssertionError('Unknown fixture scope: %s' % (scope,))
+
+        fixture_key = (scope, owners[scope], key)
+        fixture = _fixtures.get(fixture_key, self.id())
+        if fixture is not None:
+            return fixture.value
+
+        names = factory.popGeneratedNames()
+        threads_count = len(self._thread_tracker.threads)
+        ports_count = len(allocator.allocated)
+        start_memory = self.getCurrentMemoryUsage()
+        try:
+            value = create()
+        finally:
+            # What the fixture creates outlives the test.
+            factory.popGeneratedNames()
+            for name in names:
+                factory.recordGeneratedName(name)
+            del self._thread_tracker.threads[threads_count:]
+            del allocator.allocated[ports_count:]
+
+        if size is None:
+            size = max(0, self.getCurrentMemoryUsage() - start_memory)
+        _fixtures.add(
+            fixture_key, _Fixture(value, size, cleanup, self.id()))
+        if scope == 'module':
+            _releaseModuleFixtures(owners[scope])
+        evicted = _fixtures.evict(self.FIXTURE_MEMORY_CAP, self.id())
+        for fixture in evicted:
+            if fixture.cleanup is not None:
+                self.addCleanup(fixture.cleanup, fixture.value)
+        return value
+
+    def _checkThreads(self):
+        """
+        Check that the threads started during the test were stopped.
+
+        Only the threads started during the test are checked, so that the
+        leaked threads can be reported together with the place from
+        which they were started.
+        """
+        # FIXME:1077:
+        # For now we don't clean the whole reactor so Twisted is
+        # an exception here.
+        alive = self._thread_tracker.getAliveThreads(
+            timeout=self.THREAD_JOIN_TIMEOUT,
+            excepted_names=self.EXCEPTED_THREADS,
+            )
+        if not alive:
+            return
 
-        super(ChevahTestCase, self).tearDown()
+        thread, stack = alive[0]
+        raise AssertionError(
+            'There are still active threads, '
+            'beside the main thread: %s - %s\nStarted at:\n%s' % (
+                thread.getName(),
+                [alive_thread for alive_thread, _ in alive],
+                _format_stack(stack),
+                ))
 
     def addCleanup(self, function, *args, **kwargs):
         """
@@ -774,11 +2701,40 @@ class ChevahTestCase(TwistedTestCase):
     def callCleanup(self):
         """
         Call all cleanup methods.
+
+        The deferreds returned by the cleanup methods are run together in
+        a single reactor run, after all cleanup methods were called,
+        waiting at most `CLEANUP_TIMEOUT` seconds for all of them.
         """
+        deferreds = []
         for function, args, kwargs in self.__cleanup__:
-            function(*args, **kwargs)
+            result = function(*args, **kwargs)
+            if self._isDeferred(result):
+                deferreds.append(result)
         self.__cleanup__ = []
 
+        if not deferreds:
+            return
+
+        results = self.getDeferredResults(
+            deferreds, timeout=self.CLEANUP_TIMEOUT)
+        failures = [result for success, result, _ in results if not success]
+        if failures:
+            raise AssertionError('Cleanup failed:\n%s' % (
+                '\n'.join(failure.getTraceback() for failure in failures)))
+
+    @staticmethod
+    def _isDeferred(value):
+        """
+        Return True if `value` is a deferred or a coroutine.
+        """
+        iscoroutine = getattr(inspect, 'iscoroutine', None)
+        if iscoroutine is not None and iscoroutine(value):
+            return True
+        # There can be no deferreds when Twisted was not imported.
+        defer = sys.modules.get('twisted.internet.defer', None)
+        return defer is not None and isinstance(value, defer.Deferred)
+
     def _checkTemporaryFiles(self):
         """
         Check that no temporary files or folders are present.
@@ -792,6 +2748,10 @@ class ChevahTestCase(TwistedTestCase):
             else:
                 factory.fs.deleteFile(self.test_segments)
 
+        names = factory.popGeneratedNames()
+        if self.SCAN_TEMPORARY_FOLDERS:
+            names = None
+
         checks = [
             self.assertTempIsClean,
             self.assertWorkingFolderIsClean,
@@ -800,7 +2760,7 @@ class ChevahTestCase(TwistedTestCase):
         errors = []
         for check in checks:
             try:
-                check()
+                check(names=names)
             except AssertionError as error:
                 errors.append(error.message)
 
@@ -878,31 +2838,23 @@ class ChevahTestCase(TwistedTestCase):
     @staticmethod
     def skipTest(message=''):
         '''Return a SkipTest exception.'''
+        from nose import SkipTest
         return SkipTest(message)
 
-    @property
-    def _caller_success_member(self):
-        '''Retrieve the 'success' member from the test case.'''
-        success_state = None
-        # We search starting with second stack, since first stack is the
-        # current stack and we don't care about it.
-        for level in inspect.stack()[1:]:
-            try:
-                success_state = level[0].f_locals['success']
-                break
-            except KeyError:
-                success_state = None
-        if success_state is None:
-            raise AssertionError('Failed to find "success" attribute.')
-        return success_state
-
     @contextmanager
-    def listenPort(self, ip, port):
-        '''Context manager for binding a port.'''
+    def listenPort(self, ip, port=None):
+        '''
+        Context manager for binding a port.
+
+        When `port` is None, a free port is used.
+        The port is returned by the context manager.
+        '''
+        if port is None:
+            port = allocator.allocate(ip)
         test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         test_socket.bind((ip, port))
         test_socket.listen(0)
-        yield
+        yield port
         try:
             # We use shutdown to force closing the socket.
             test_socket.shutdown(socket.SHUT_RDWR)
@@ -931,37 +2883,55 @@ class ChevahTestCase(TwistedTestCase):
         """
         Helper for generic patching.
         """
-        return patch(*args, **kwargs)
+        return _get_patch()(*args, **kwargs)
 
     @staticmethod
     def patchObject(*args, **kwargs):
         """
         Helper for patching objects.
         """
-        return patch.object(*args, **kwargs)
+        return _get_patch().object(*args, **kwargs)
 
     @classmethod
-    def cleanTemporaryFolder(cls):
+    def cleanTemporaryFolder(cls, names=None):
         """
         Clean all test files from temporary folder.
 
+        When `names` is provided, only the members with these names are
+        cleaned, without listing the whole folder.
+
         Return a list of members which were removed.
         """
-        return cls._cleanFolder(factory.fs.temp_segments)
+        return cls._cleanFolder(factory.fs.temp_segments, names=names)
 
     @classmethod
-    def cleanWorkingFolder(cls):
+    def cleanWorkingFolder(cls, names=None):
+        return cls._cleanFolder(
+            cls._getWorkingFolderSegments(), names=names)
+
+    @staticmethod
+    def _getWorkingFolderSegments():
+        """
+        Return the segments of the current working folder.
+        """
         path = factory.fs.getAbsoluteRealPath('.')
-        segments = factory.fs.getSegmentsFromRealPath(path)
-        return cls._cleanFolder(segments)
+        return factory.fs.getSegmentsFromRealPath(path)
 
     @classmethod
-    def _cleanFolder(cls, folder_segments):
+    def _cleanFolder(cls, folder_segments, names=None):
         """
         Clean all test files from folder_segments.
 
+        When `names` is provided, only the members with these names, or
+        with these names and a suffix recorded by
+        `factory.recordDerivedSuffix`, are cleaned, without listing the
+        whole folder.
+
         Return a list of members which were removed.
         """
+        if names is not None and not names:
+            return []
+
         if not factory.fs.exists(folder_segments):
             return []
 
@@ -973,8 +2943,19 @@ class ChevahTestCase(TwistedTestCase):
             temp_avatar = DefaultAvatar()
 
         temp_filesystem = LocalFilesystem(avatar=temp_avatar)
+        if names is None:
+            members = temp_filesystem.getFolderContent(folder_segments)
+        else:
+            suffixes = [u''] + sorted(factory.getDerivedSuffixes())
+            members = [
+                name + suffix
+                for name in sorted(names)
+                for suffix in suffixes
+                if temp_filesystem.exists(folder_segments + [name + suffix])
+                ]
+
         temp_members = []
-        for member in (temp_filesystem.getFolderContent(folder_segments)):
+        for member in members:
             if member.find(TEST_NAME_MARKER) != -1:
                 temp_members.append(member)
                 segments = folder_segments[:]
@@ -986,6 +2967,74 @@ class ChevahTestCase(TwistedTestCase):
 
         return temp_members
 
+    @classmethod
+    def getCurrentMemoryUsage(cls):
+        """
+        Return the current memory usage (resident set size) in kilo bytes.
+
+        When the current usage is not available, the peak usage is
+        returned.
+        """
+        try:
+            with open('/proc/self/statm', 'r') as statm:
+                resident_pages = int(statm.read().split()[1])
+        except (IOError, OSError, ValueError, IndexError):
+            return cls.getPeakMemoryUsageSinceReset()
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+    @classmethod
+    def resetPeakMemoryUsage(cls):
+        """
+        Reset the peak memory usage returned by
+        `getPeakMemoryUsageSinceReset` to the current memory usage.
+
+        Return False when the peak can not be reset on this system.
+        """
+        peak = cls._getProcStatusValue('VmHWM')
+        if peak is not None:
+            # The reset also affects the peak reported by the system for
+            # the whole process, so it is kept for getPeakMemoryUsage.
+            ChevahTestCase._peak_memory_before_reset = max(
+                peak, ChevahTestCase._peak_memory_before_reset)
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                # Resets the peak resident set size.
+                clear_refs.write('5')
+        except (IOError, OSError):
+            return False
+        return True
+
+    @classmethod
+    def getPythonMemoryUsage(cls):
+        """
+        Return the memory allocated by Python in kilo bytes, as traced by
+        tracemalloc, or None when the allocations are not traced.
+
+        Start Python with `PYTHONTRACEMALLOC=1` to trace the allocations.
+        """
+        try:
+            import tracemalloc
+        except ImportError:
+            return None
+        if not tracemalloc.is_tracing():
+            return None
+        current, _ = tracemalloc.get_traced_memory()
+        return current // 1024
+
+    @classmethod
+    def getPeakMemoryUsageSinceReset(cls):
+        """
+        Return the maximum memory usage in kilo bytes since the last call
+        to `resetPeakMemoryUsage`.
+
+        When the peak can not be reset on this system, the maximum memory
+        usage of the process is returned.
+        """
+        peak = cls._getProcStatusValue('VmHWM')
+        if peak is not None:
+            return peak
+        return cls.getPeakMemoryUsage()
+
     @classmethod
     def getPeakMemoryUsage(cls):
         """
@@ -993,7 +3042,14 @@ class ChevahTestCase(TwistedTestCase):
         """
         if cls.os_family == 'posix':
             import resource
-            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peaks = [
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                ChevahTestCase._peak_memory_before_reset,
+                ]
+            recent_peak = cls._getProcStatusValue('VmHWM')
+            if recent_peak is not None:
+                peaks.append(recent_peak)
+            return max(peaks)
         elif cls.os_family == 'nt':
             from wmi import WMI
             local_wmi = WMI('.')
@@ -1010,25 +3066,46 @@ class ChevahTestCase(TwistedTestCase):
         else:
             raise AssertionError('OS not supported.')
 
+    @staticmethod
+    def _getProcStatusValue(name):
+        """
+        Return the value in kilo bytes for `name` from /proc/self/status,
+        or None when not available.
+        """
+        try:
+            with open('/proc/self/status', 'r') as status:
+                for line in status:
+                    if line.startswith(name + ':'):
+                        return int(line.split()[1])
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+        return None
+
     @classmethod
-    def assertTempIsClean(cls):
+    def assertTempIsClean(cls, names=None):
         """
         Raise an error if the temporary folder contains any testing
         specific files for folders.
+
+        When `names` is provided, only the members with these names are
+        checked.
         """
-        members = cls.cleanTemporaryFolder()
+        members = cls.cleanTemporaryFolder(names=names)
         if members:
             message = u'Temporary folder is not clean. %s' % (
                 u', '.join(members))
             raise AssertionError(message.encode('utf-8'))
 
     @classmethod
-    def assertWorkingFolderIsClean(cls):
+    def assertWorkingFolderIsClean(cls, names=None):
         """
         Raise an error if the current working folder contains any testing
         specific files for folders.
+
+        When `names` is provided, only the members with these names are
+        checked.
         """
-        members = cls.cleanWorkingFolder()
+        members = cls.cleanWorkingFolder(names=names)
         if members:
             message = u'Working folder is not clean. %s' % (
                 u', '.join(members))
@@ -1058,20 +3135,36 @@ class ChevahTestCase(TwistedTestCase):
                 "Expecting type %s, but got %s. %s" % (
                     expected_type, type(value), msg))
 
+    def waitForListening(self, addresses, timeout=1):
+        '''
+        Wait until all `addresses`, a list of (ip, port), accept
+        connections.
+
+        All addresses are probed in parallel, and the ones refusing the
+        connection are probed again until `timeout` seconds have passed.
+        Raise an AssertionError with the addresses which are not
+        listening after `timeout`.
+        '''
+        listening = _probe_listening(addresses, timeout=timeout, retry=True)
+        missing = [
+            '%s:%d' % address for address in addresses
+            if address not in listening
+            ]
+        if missing:
+            raise AssertionError(
+                'It seems that no one is listening on %s' % (
+                    ', '.join(missing)))
+
     def assertIsListening(self, ip, port, debug=False, clear_log=False):
         '''Check if the port and address are in listening mode.'''
-        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        test_socket.settimeout(1.0)
-        try:
-            test_socket.connect((ip, port))
-            sock_name = test_socket.getsockname()
-            test_socket.shutdown(socket.SHUT_RDWR)
-            if debug:
-                print('Connected as: %s:%d' % (sock_name[0], sock_name[1]))
-        except:
+        listening = _probe_listening([(ip, port)], timeout=1)
+        if (ip, port) not in listening:
             raise AssertionError(
                 'It seems that no one is listening on %s:%d' % (
                     ip, port))
+        if debug:
+            sock_name = listening[(ip, port)]
+            print('Connected as: %s:%d' % (sock_name[0], sock_name[1]))
         if clear_log:
             # Clear the log since we don't care about log generated by
             # assertIsListening.
@@ -1081,9 +3174,7 @@ class ChevahTestCase(TwistedTestCase):
 
     def assertIsNotListening(self, ip, port):
         '''Check if the port and address are in listening mode.'''
-        try:
-            self.assertIsListening(ip, port)
-        except AssertionError:
+        if (ip, port) not in _probe_listening([(ip, port)], timeout=1):
             return
         raise AssertionError(
             'It seems that someone is listening on %s:%d' % (
@@ -1113,6 +3204,7 @@ class ChevahTestCase(TwistedTestCase):
 
     def assertFailureType(self, failure_class, failure_or_deferred):
         '''Raise assertion error if failure is not of required type.'''
+        Failure = _get_twisted('python.failure').Failure
         if isinstance(failure_or_deferred, Failure):
             failure = failure_or_deferred
         else:
@@ -1129,6 +3221,7 @@ class ChevahTestCase(TwistedTestCase):
         Raise `AssertionError` if failure does not have the required id or
         the specified id is not unicode.
         """
+        Failure = _get_twisted('python.failure').Failure
         if isinstance(failure_or_deferred, Failure):
             failure = failure_or_deferred
         else:
@@ -1152,6 +3245,7 @@ class ChevahTestCase(TwistedTestCase):
         """
         Raise AssertionError if failure does not contain the required data.
         """
+        Failure = _get_twisted('python.failure').Failure
         if isinstance(failure_or_deferred, Failure):
             failure = failure_or_deferred
         else:
@@ -1292,6 +3386,7 @@ class ChevahTestCase(TwistedTestCase):
             raise AssertionError(message.encode('utf-8'))
 
     def assertProvides(self, interface, obj):
+        from zope.interface.verify import verifyObject
         self.assertTrue(
             interface.providedBy(obj),
             'Object %s does not provided interface %s.' % (obj, interface))
@@ -1309,6 +3404,46 @@ class ChevahTestCase(TwistedTestCase):
                 klass, interface))
 
 
+class _FixtureRelease(ChevahTestCase):
+    """
+    Releases the shared fixtures at the end of their scope, by calling
+    their cleanups as the cleanups of this test.
+    """
+
+    def __init__(self, fixtures):
+        super(_FixtureRelease, self).__init__('runTest')
+        self._fixtures_to_release = fixtures
+        self._release_errors = []
+
+    def setUp(self):
+        super(_FixtureRelease, self).setUp()
+        for fixture in self._fixtures_to_release:
+            self.addCleanup(self._callFixtureCleanup, fixture)
+
+    def runTest(self):
+        """
+        The fixtures are released by the cleanups.
+        """
+
+    def _callFixtureCleanup(self, fixture):
+        """
+        Call the cleanup of `fixture`, recording the error, so that the
+        other cleanups are still called.
+        """
+        try:
+            return fixture.cleanup(fixture.value)
+        except Exception:
+            self._release_errors.append(traceback.format_exc())
+
+    def tearDown(self):
+        try:
+            super(_FixtureRelease, self).tearDown()
+        except AssertionError as error:
+            self._release_errors.append(error.args[0])
+        if self._release_errors:
+            raise AssertionError('\n'.join(self._release_errors))
+
+
 class CommandTestCase(ChevahTestCase):
     '''A test case that catches sys.exit, sys.stdout and sys.stderr.
 
@@ -7,6 +7,8 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 from future.types import newstr
+import socket
+
 import requests
 
 from chevah.empirical.mockup import (
@@ -15,6 +17,7 @@ from chevah.empirical.mockup import (
     HTTPServerContext,
     )
 from chevah.empirical import EmpiricalTestCase, mk
+from chevah.empirical.ports import allocator
 
 
 class TestHTTPServerContext(EmpiricalTestCase):
@@ -273,6 +276,44 @@ class TestFactory(EmpiricalTestCase):
             )
         self.assertIsInstance(newstr, mk.string())
 
+    def test_getFreePort(self):
+        """
+        A port which can be bound is returned, and is not returned again
+        during the test.
+        """
+        port = mk.getFreePort()
+
+        self.assertNotEqual(port, mk.getFreePort())
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', port))
+
+    def test_makeIPv4Address_remote_host(self):
+        """
+        An address can be created for a host which is not local, using a
+        port which is free on the local host.
+        """
+        result = mk.makeIPv4Address(host='192.0.2.10')
+
+        self.assertEqual('192.0.2.10', result.host)
+        self.assertEqual('TCP', result.type)
+        self.assertEqual(self._ports_start + 1, len(allocator.allocated))
+        self.assertEqual(allocator.allocated[-1], result.port)
+
+    def test_popGeneratedNames(self):
+        """
+        The unique strings and the file names are recorded until they are
+        popped.
+        """
+        mk.popGeneratedNames()
+        name = mk.string()
+        filename = mk.makeFilename(prefix=u'pre-', suffix=u'.txt')
+
+        result = mk.popGeneratedNames()
+
+        self.assertEqual(set([name, filename]), result)
+        self.assertEqual(set(), mk.popGeneratedNames())
+
     def test_number(self):
         """
         It will return different values at each call.
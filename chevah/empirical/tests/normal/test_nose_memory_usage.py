@@ -0,0 +1,88 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for nose memory usage plugin.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from builtins import object
+
+from bunch import Bunch
+
+from chevah.empirical import EmpiricalTestCase
+from chevah.empirical.nose_memory_usage import MemoryUsage
+
+
+class FakeMemory(object):
+    """
+    Memory usage values returned in order for each call.
+    """
+
+    def __init__(self, peak_reset, peak, current, python):
+        self._peak_reset = peak_reset
+        self._peak = list(peak)
+        self._current = list(current)
+        self._python = list(python)
+
+    def resetPeakMemoryUsage(self):
+        return self._peak_reset
+
+    def getPeakMemoryUsageSinceReset(self):
+        return self._peak.pop(0)
+
+    def getCurrentMemoryUsage(self):
+        return self._current.pop(0)
+
+    def getPythonMemoryUsage(self):
+        return self._python.pop(0)
+
+
+class TestMemoryUsage(EmpiricalTestCase):
+    """
+    Test for MemoryUsage.
+    """
+
+    def getMemoryUsage(self, memory):
+        """
+        Return a configured plugin using the `memory` values.
+        """
+        sut = MemoryUsage()
+        sut.enabled = False
+        sut.configure(Bunch(), None)
+        sut.getTestCase = lambda: memory
+        return sut
+
+    def test_stopTest_peak_reset(self):
+        """
+        When the peak is reset at the start of the test, the peak usage is
+        computed from the memory usage at the start of the test.
+        """
+        sut = self.getMemoryUsage(FakeMemory(
+            peak_reset=True,
+            peak=[1000, 1500],
+            current=[900, 1000],
+            python=[100, 150],
+            ))
+
+        sut.startTest(Bunch(id=lambda: 'test_1'))
+        sut.stopTest(Bunch(id=lambda: 'test_1'))
+
+        self.assertEqual({'test_1': (600, 100, 50)}, sut._memory_usage)
+
+    def test_stopTest_no_peak_reset(self):
+        """
+        When the peak can not be reset, only the increase of the process
+        peak is known.
+        """
+        sut = self.getMemoryUsage(FakeMemory(
+            peak_reset=False,
+            peak=[1000, 1500],
+            current=[900, 1000],
+            python=[None, None],
+            ))
+
+        sut.startTest(Bunch(id=lambda: 'test_1'))
+        sut.stopTest(Bunch(id=lambda: 'test_1'))
+
+        self.assertEqual({'test_1': (500, 100, None)}, sut._memory_usage)
@@ -0,0 +1,55 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for nose reactor usage plugin.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+from bunch import Bunch
+
+from chevah.empirical import EmpiricalTestCase
+from chevah.empirical.nose_reactor_usage import ReactorUsage
+
+
+class TestReactorUsage(EmpiricalTestCase):
+    """
+    Test for ReactorUsage.
+    """
+
+    def getReport(self, test_id, slow_calls):
+        """
+        Return a reactor report for `test_id`.
+        """
+        return Bunch(
+            test_id=test_id,
+            iterations=3,
+            run_until_current=0.5,
+            do_iteration=0.25,
+            delayed_calls=2,
+            slow_calls=slow_calls,
+            iteration_times=[(0.25, 0.125, 1), (0.25, 0.125, 1), (0, 0, 0)],
+            )
+
+    def test_addReport(self):
+        """
+        Reactor time is aggregated for each test, and slow delayed calls are
+        aggregated for each delayed call name.
+        """
+        sut = ReactorUsage()
+        sut.enabled = False
+        sut.configure(Bunch(), None)
+
+        sut.addReport(self.getReport(
+            'test_1', [('slow_call', 0.25), ('other_call', 0.5)]))
+        sut.addReport(self.getReport('test_2', [('slow_call', 0.75)]))
+
+        self.assertEqual(
+            {'test_1': (0.75, 3, 2, 0.375), 'test_2': (0.75, 3, 2, 0.375)},
+            sut._reactor_usage,
+            )
+        self.assertEqual(
+            {'slow_call': (2, 1.0, 0.75), 'other_call': (1, 0.5, 0.5)},
+            sut._slow_calls,
+            )
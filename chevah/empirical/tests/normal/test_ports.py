@@ -0,0 +1,191 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for the port allocator.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import multiprocessing
+import os
+import socket
+
+from bunch import Bunch
+
+from chevah.empirical import EmpiricalTestCase
+from chevah.empirical.ports import PortAllocator
+
+
+class TestPortAllocator(EmpiricalTestCase):
+    """
+    Tests for PortAllocator.
+
+    The ports are not bound, so that the tests don't depend on the ports
+    used by other processes.
+    """
+
+    def makeAllocator(self, worker_id=None, used_ports=()):
+        """
+        Return an allocator for which all ports are free, other than
+        `used_ports`.
+        """
+        sut = PortAllocator(worker_id=worker_id)
+        sut._isFree = lambda ip, port: port not in used_ports
+        return sut
+
+    def test_init_worker_id(self):
+        """
+        Each worker gets a different range of ports.
+        """
+        first = self.makeAllocator(worker_id=0)
+        second = self.makeAllocator(worker_id=3)
+        wrapped = self.makeAllocator(worker_id=20)
+
+        self.assertEqual(PortAllocator.FIRST_PORT, first.allocate())
+        self.assertEqual(PortAllocator.FIRST_PORT + 1500, second.allocate())
+        self.assertEqual(PortAllocator.FIRST_PORT, wrapped.allocate())
+
+    def test_init_worker_id_environment(self):
+        """
+        The worker ID is read from the environment.
+        """
+        sut = self.makeAllocator()
+
+        with self.patchObject(
+                os, 'environ', {'PYTEST_XDIST_WORKER': 'gw2'}):
+            result = sut.allocate()
+
+        self.assertEqual(PortAllocator.FIRST_PORT + 1000, result)
+
+    def test_init_worker_id_multiprocessing(self):
+        """
+        For a multiprocessing child process, as started by the nose
+        multiprocess plugin, the worker ID is the number of the child
+        process.
+        """
+        sut = self.makeAllocator()
+
+        with self.patchObject(os, 'environ', {}):
+            with self.patchObject(
+                    multiprocessing, 'current_process',
+                    return_value=Bunch(_identity=(3,)),
+                    ):
+                result = sut.allocate()
+
+        self.assertEqual(PortAllocator.FIRST_PORT + 1500, result)
+
+    def test_init_worker_id_main_process(self):
+        """
+        Without a worker ID, the process is the only worker.
+        """
+        sut = self.makeAllocator()
+
+        with self.patchObject(os, 'environ', {}):
+            with self.patchObject(
+                    multiprocessing, 'current_process',
+                    return_value=Bunch(_identity=()),
+                    ):
+                result = sut.allocate()
+
+        self.assertEqual(PortAllocator.FIRST_PORT, result)
+
+    def test_allocate_after_fork(self):
+        """
+        The worker range is computed again in a forked process.
+        """
+        sut = self.makeAllocator()
+
+        with self.patchObject(os, 'environ', {'EMPIRICAL_WORKER_ID': '1'}):
+            parent = sut.allocate()
+            with self.patchObject(os, 'getpid', return_value=-1):
+                with self.patchObject(
+                        os, 'environ', {'EMPIRICAL_WORKER_ID': '2'}):
+                    child = sut.allocate()
+
+        self.assertEqual(PortAllocator.FIRST_PORT + 500, parent)
+        self.assertEqual(PortAllocator.FIRST_PORT + 1000, child)
+
+    def test_allocate(self):
+        """
+        Ports are handed out in turn and reserved ports are not handed out
+        again until released.
+        """
+        sut = self.makeAllocator(worker_id=1)
+        first_port = PortAllocator.FIRST_PORT + 500
+
+        first = sut.allocate()
+        second = sut.allocate()
+
+        self.assertEqual(first_port, first)
+        self.assertEqual(first_port + 1, second)
+        self.assertEqual([first, second], sut.allocated)
+
+        sut.releaseAllocated()
+
+        self.assertEqual([], sut.allocated)
+        self.assertEqual(first_port + 2, sut.allocate())
+
+    def test_allocate_in_use(self):
+        """
+        Ports which can not be bound are skipped.
+        """
+        first_port = PortAllocator.FIRST_PORT + 1000
+        sut = self.makeAllocator(worker_id=2, used_ports=[first_port])
+
+        result = sut.allocate()
+
+        self.assertEqual(first_port + 1, result)
+
+    def test_allocate_all_reserved(self):
+        """
+        It fails when all ports from the worker range are reserved.
+        """
+        sut = self.makeAllocator(worker_id=0)
+        sut.PARTITION_SIZE = 2
+        sut.allocate()
+        sut.allocate()
+
+        with self.assertRaises(AssertionError) as context:
+            sut.allocate()
+
+        self.assertEqual(
+            'No free port in 20000-20001.', context.exception.args[0])
+
+    def test_release(self):
+        """
+        A released port can be handed out again.
+        """
+        sut = self.makeAllocator(worker_id=0)
+        sut.PARTITION_SIZE = 2
+        first = sut.allocate()
+        sut.allocate()
+
+        sut.release(first)
+
+        self.assertEqual(first, sut.allocate())
+
+    def test_releaseAllocated_keep(self):
+        """
+        The first `keep` allocated ports stay reserved.
+        """
+        sut = self.makeAllocator(worker_id=0)
+        sut.PARTITION_SIZE = 2
+        first = sut.allocate()
+        second = sut.allocate()
+
+        sut.releaseAllocated(keep=1)
+
+        self.assertEqual([first], sut.allocated)
+        self.assertEqual(second, sut.allocate())
+
+    def test_isFree(self):
+        """
+        A port which is bound is not free.
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        # Let the OS choose a free port.
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+
+        self.assertFalse(PortAllocator._isFree('127.0.0.1', port))
@@ -0,0 +1,111 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for the protocol load harness.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+from twisted.internet import reactor
+from twisted.protocols.basic import LineReceiver
+
+from chevah.empirical import EmpiricalTestCase
+from chevah.empirical.protocol_load import ProtocolLoadHarness
+
+
+class EchoProtocol(LineReceiver):
+    """
+    Protocol which sends a greeting and then echoes each line.
+    """
+
+    def connectionMade(self):
+        self.sendLine(b'220 Welcome')
+
+    def lineReceived(self, line):
+        self.sendLine(b'200 ' + line)
+
+
+class DelayedEchoProtocol(LineReceiver):
+    """
+    Protocol which echoes each line using the reactor.
+    """
+
+    lost = False
+
+    def lineReceived(self, line):
+        reactor.callLater(0.001, self.sendLine, b'200 ' + line)
+
+    def connectionLost(self, reason):
+        self.lost = True
+
+
+class TestProtocolLoadHarness(EmpiricalTestCase):
+    """
+    Tests for ProtocolLoadHarness.
+    """
+
+    def test_run(self):
+        """
+        All commands from the script are sent to all protocols and the
+        throughput is measured.
+        """
+        sut = ProtocolLoadHarness(
+            test=self,
+            protocol_factory=EchoProtocol,
+            script=[b'USER test\r\n', b'PWD\r\n'],
+            count=3,
+            )
+
+        result = sut.run()
+
+        self.assertEqual(6, result.commands)
+        self.assertEqual(3 * 16, result.bytes_sent)
+        self.assertEqual(3 * (13 + 15 + 9), result.bytes_received)
+        self.assertLess(0, result.commands_per_second)
+        self.assertLess(0, result.bytes_per_second)
+        self.assertLessEqual(result.p50, result.p99)
+        self.assertEqual(3, len(result.transports))
+        self.assertEqual(
+            b'220 Welcome\r\n200 USER test\r\n200 PWD\r\n',
+            result.transports[0].value(),
+            )
+
+    def test_run_delayed_response(self):
+        """
+        Responses sent later by the reactor are waited for, and the
+        protocols are disconnected at the end.
+        """
+        protocols = []
+
+        def protocol_factory():
+            protocol = DelayedEchoProtocol()
+            protocols.append(protocol)
+            return protocol
+
+        sut = ProtocolLoadHarness(
+            test=self,
+            protocol_factory=protocol_factory,
+            script=[b'NOOP\r\n'] * 3,
+            count=2,
+            )
+
+        result = sut.run()
+
+        self.assertEqual(6, result.commands)
+        self.assertLessEqual(0.001, result.p50)
+        self.assertEqual(
+            b'200 NOOP\r\n' * 3, result.transports[1].value())
+        self.assertEqual([True, True], [p.lost for p in protocols])
+
+    def test_getPercentile(self):
+        """
+        The percentile is computed using the nearest rank.
+        """
+        values = list(range(1, 101))
+
+        self.assertEqual(50, ProtocolLoadHarness._getPercentile(values, 0.5))
+        self.assertEqual(
+            99, ProtocolLoadHarness._getPercentile(values, 0.99))
+        self.assertEqual(1, ProtocolLoadHarness._getPercentile([1], 0.99))
+        self.assertIsNone(ProtocolLoadHarness._getPercentile([], 0.5))
@@ -8,15 +8,32 @@ from __future__ import division
 from __future__ import absolute_import
 from builtins import object
 import os
+import signal
+import socket
+import subprocess
 import sys
+import threading
 import time
+import types
+import unittest
 
 from twisted.internet import defer, reactor, threads
 from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 
 from chevah.compat import process_capabilities
-from chevah.empirical import conditionals, EmpiricalTestCase, mk
+from chevah.empirical import (
+    conditionals,
+    EmpiricalTestCase,
+    mk,
+    mockup,
+    testcase,
+    )
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
 
 
 class Dummy(object):
@@ -178,6 +195,56 @@ class TestTwistedTestCase(EmpiricalTestCase):
         self.assertIsFalse(reactor._started)
         self.assertIsNone(reactor.threadpool)
 
+    def test_getDeferredResults(self):
+        """
+        getDeferredResults runs all deferreds concurrently in a single
+        reactor run and returns the results and failures in order,
+        together with the completion latency.
+        """
+        slow = defer.Deferred()
+        fast = defer.Deferred()
+        failed = defer.Deferred()
+        reactor.callLater(0.1, lambda d: d.callback('slow'), slow)
+        reactor.callLater(0.01, lambda d: d.callback('fast'), fast)
+        reactor.callLater(
+            0.01, lambda d: d.errback(RuntimeError('bad')), failed)
+
+        with self.patchObject(
+                reactor, 'startRunning', wraps=reactor.startRunning,
+                ) as mock_start:
+            results = self.getDeferredResults(
+                [slow, fast, defer.succeed('done'), failed], timeout=0.5)
+
+        self.assertEqual(1, mock_start.call_count)
+        self.assertEqual(
+            [(True, 'slow'), (True, 'fast'), (True, 'done')],
+            [(success, result) for success, result, _ in results[:3]],
+            )
+        success, failure, _ = results[3]
+        self.assertFalse(success)
+        self.assertFailureType(RuntimeError, failure)
+        latencies = [latency for _, _, latency in results]
+        # Deferreds are run concurrently.
+        self.assertLess(latencies[0], 0.2)
+        self.assertLess(latencies[1], latencies[0])
+        self.assertLess(latencies[2], 0.01)
+        self.assertFalse(reactor._started)
+
+    def test_getDeferredResults_timeout(self):
+        """
+        An assertion error is raised when not all deferreds get a result
+        in `timeout` seconds.
+        """
+        with self.assertRaises(AssertionError) as context:
+            self.getDeferredResults(
+                [defer.succeed(None), defer.Deferred()], timeout=0)
+
+        self.assertEqual(
+            'Deferred took more than 0 to execute.',
+            context.exception.args[0]
+            )
+        self._reactor_timeout_failure = None
+
     def test_assertNoResult_good(self):
         """
         assertNoResult will not fail if deferred has no result yet.
@@ -305,6 +372,22 @@ class TestTwistedTestCase(EmpiricalTestCase):
         self.assertTrue(self.called)
         self.assertTrue(deferred.called)
 
+    def test_executeReactor_threadpool_no_polling(self):
+        """
+        It is woken as soon as the jobs from the thread pool are done,
+        without polling the thread pool.
+        """
+        done = threading.Event()
+        reactor.callInThread(done.wait, 0.2)
+
+        with self.patchObject(
+                reactor, 'doIteration', wraps=reactor.doIteration,
+                ) as mock_iteration:
+            self.executeReactor()
+
+        # When polling, the reactor is iterated every 10 milliseconds.
+        self.assertLess(mock_iteration.call_count, 10)
+
     def test_assertReactorIsClean_excepted_deferred(self):
         """
         Will raise an error if a delayed call is still on the reactor queue.
@@ -327,6 +410,60 @@ class TestTwistedTestCase(EmpiricalTestCase):
         delayed_call.cancel()
         self.executeReactor()
 
+    def test_assertReactorIsClean_reader(self):
+        """
+        Will raise an error if a reader added during the test is still
+        on the reactor, without looking at all the reactor readers.
+        """
+        class Reader(object):
+            def __init__(self, sock):
+                self._sock = sock
+
+            def fileno(self):
+                return self._sock.fileno()
+
+            def logPrefix(self):  # pragma: no cover
+                return 'Reader'
+
+        first, second = socket.socketpair()
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        reader = Reader(first)
+        reactor.addReader(reader)
+
+        with self.patchObject(reactor, 'getReaders') as mock_readers:
+            with self.assertRaises(AssertionError) as context:
+                self.assertReactorIsClean()
+
+            reactor.removeReader(reader)
+            self.assertReactorIsClean()
+
+        self.assertStartsWith(
+            'Reactor is not clean. readers: [', context.exception.args[0])
+        self.assertFalse(mock_readers.called)
+
+    def test_assertReactorIsClean_previous_delayed_call(self):
+        """
+        Delayed calls which were added before the test are not checked.
+        """
+        def much_later():  # pragma: no cover
+            """
+            This is here to have a name.
+            """
+
+        delayed_call = reactor.callLater(10, much_later)
+
+        class InnerTest(EmpiricalTestCase):
+            def test_inner(self):
+                pass
+
+        result = unittest.TestResult()
+        InnerTest('test_inner').run(result)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertTrue(delayed_call.active())
+        delayed_call.cancel()
+
     def test_assertReactorIsClean_excepted_delayed_calls(self):
         """
         Will not raise an error if delayed call should be ignored.
@@ -338,12 +475,895 @@ class TestTwistedTestCase(EmpiricalTestCase):
 
         self.EXCEPTED_DELAYED_CALLS = ['much_later']
 
-        delayed_call = reactor.callLater(10, much_later)
+        delayed_call = reactor.callLater(10, much_later)
+
+        self.assertReactorIsClean()
+        # Cancel and remove it so that other tests will not fail.
+        delayed_call.cancel()
+        self.executeReactor()
+
+    def test_executeReactor_excepted_delayed_call_substring(self):
+        """
+        It will not wait for delayed calls with names containing any of
+        the excepted names.
+        """
+        def much_later():  # pragma: no cover
+            """
+            This is here to have a name.
+            """
+
+        self.EXCEPTED_DELAYED_CALLS = ['other_name', 'uch_lat']
+        delayed_call = reactor.callLater(10, much_later)
+
+        self.executeReactor()
+
+        self.assertTrue(delayed_call.active())
+        delayed_call.cancel()
+
+    def test_getDelayedCallName_cached(self):
+        """
+        The name of a delayed call is computed only once for a callable,
+        even when the callable is a bound method.
+        """
+        class Target(object):
+            repr_calls = 0
+
+            def __repr__(self):
+                Target.repr_calls += 1
+                return 'Target'
+
+            def method(self):  # pragma: no cover
+                """
+                This is here to have a name.
+                """
+
+        target = Target()
+        first = reactor.callLater(10, target.method)
+        second = reactor.callLater(10, target.method)
+
+        first_name = self._getDelayedCallName(first)
+        second_name = self._getDelayedCallName(second)
+
+        self.assertEqual(first_name, second_name)
+        self.assertTrue(first_name.endswith('method'))
+        self.assertLessEqual(Target.repr_calls, 1)
+        first.cancel()
+        second.cancel()
+
+
+def make_coroutine(deferred):
+    """
+    Return a coroutine waiting for `deferred` and returning its result.
+
+    The coroutine is created from source since the syntax is not available
+    on all supported Python versions.
+    """
+    namespace = {}
+    exec(
+        'async def wait(deferred):\n'
+        '    return await deferred\n',
+        namespace,
+        )
+    return namespace['wait'](deferred)
+
+
+@conditionals.skipOnCondition(
+    lambda: asyncio is None or getattr(defer, 'ensureDeferred', None) is None,
+    'Coroutines are not supported.')
+class TestTwistedTestCaseCoroutine(EmpiricalTestCase):
+    """
+    Tests for running coroutines with TwistedTestCase.
+    """
+
+    def test_getDeferredResult(self):
+        """
+        getDeferredResult accepts a coroutine and returns its result.
+        """
+        deferred = defer.Deferred()
+        reactor.callLater(0.01, lambda d: d.callback('ok'), deferred)
+
+        result = self.getDeferredResult(make_coroutine(deferred))
+
+        self.assertEqual('ok', result)
+
+    def test_getDeferredFailure(self):
+        """
+        getDeferredFailure accepts a coroutine and returns its failure.
+        """
+        deferred = defer.fail(RuntimeError('bad'))
+
+        failure = self.getDeferredFailure(make_coroutine(deferred))
+
+        self.assertFailureType(RuntimeError, failure)
+
+    def test_getDeferredResults(self):
+        """
+        getDeferredResults accepts coroutines together with deferreds.
+        """
+        results = self.getDeferredResults(
+            [make_coroutine(defer.succeed('first')), defer.succeed('second')])
+
+        self.assertEqual(
+            ['first', 'second'], [result for _, result, _ in results])
+
+    def test_runDeferred_future_without_asyncio_reactor(self):
+        """
+        An asyncio future can not be used when the reactor is not based on
+        asyncio.
+        """
+        if getattr(reactor, '_asyncioEventloop', None) is not None:
+            raise self.skipTest('Reactor is based on asyncio.')
+        future = asyncio.Future(loop=asyncio.new_event_loop())
+
+        with self.assertRaises(AssertionError) as context:
+            self.runDeferred(future)
+
+        self.assertEqual(
+            'asyncio futures can only be used with the asyncio reactor.',
+            context.exception.args[0],
+            )
+
+
+class TestTwistedTestCaseLeakStacks(EmpiricalTestCase):
+    """
+    Tests for recording where the reactor leaks were created.
+    """
+
+    REACTOR_LEAK_STACKS = True
+
+    def test_assertReactorIsClean_delayed_call(self):
+        """
+        The failure contains the stack from where the leaked delayed call
+        was created.
+        """
+        def much_later():  # pragma: no cover
+            """
+            This is here to have a name.
+            """
+
+        def schedule_call():
+            return reactor.callLater(10, much_later)
+
+        delayed_call = schedule_call()
+
+        with self.assertRaises(AssertionError) as context:
+            self.assertReactorIsClean()
+
+        message = context.exception.args[0]
+        self.assertStartsWith(
+            u'Reactor is not clean. delayed calls: much_later\n'
+            u'Created at:\n',
+            message,
+            )
+        self.assertEndsWith(
+            u'in schedule_call\n'
+            u'    return reactor.callLater(10, much_later)',
+            message,
+            )
+        self.assertContains(
+            u'in test_assertReactorIsClean_delayed_call', message)
+        delayed_call.cancel()
+
+    def test_stack_depth(self):
+        """
+        Only the last REACTOR_LEAK_STACK_DEPTH frames are recorded.
+        """
+        stacks = []
+
+        class InnerTest(EmpiricalTestCase):
+            REACTOR_LEAK_STACKS = True
+            REACTOR_LEAK_STACK_DEPTH = 1
+
+            def test_inner(self):
+                delayed_call = reactor.callLater(10, lambda: None)
+                stacks.append(
+                    self._reactor_tracker.getCreationStack(delayed_call))
+                delayed_call.cancel()
+
+        result = unittest.TestResult()
+
+        InnerTest('test_inner').run(result)
+
+        self.assertTrue(result.wasSuccessful())
+        stack = stacks[0]
+        self.assertEqual(2, len(stack.splitlines()))
+        self.assertContains(u'in test_inner', stack)
+
+
+class TestTwistedTestCaseReactorTrace(EmpiricalTestCase):
+    """
+    Tests for the reactor trace recorded when running in debug mode.
+    """
+
+    REACTOR_TRACE_SIZE = 3
+
+    def test_runDeferred_debug(self):
+        """
+        In debug mode, the state of the reactor is recorded for the last
+        iterations, without printing it.
+        """
+        deferred = defer.Deferred()
+        reactor.callLater(0.01, lambda d: d.callback('ok'), deferred)
+
+        with self.patch('sys.stdout') as mock_stdout:
+            self.runDeferred(deferred, debug=True)
+
+        self.assertFalse(mock_stdout.write.called)
+        self.assertEqual(3, len(self._reactor_trace))
+        trace = self._getReactorTrace()
+        lines = trace.splitlines()
+        self.assertEqual('Reactor trace for last 3 iterations:', lines[0])
+        self.assertEqual(4, len(lines))
+        self.assertStartsWith('0.000000 delayed=', lines[1])
+
+    def test_runDeferred_debug_timeout(self):
+        """
+        The trace is included in the timeout error.
+        """
+        deferred = defer.Deferred()
+
+        with self.assertRaises(AssertionError) as context:
+            self.runDeferred(deferred, timeout=0, debug=True)
+
+        self.assertStartsWith(
+            'Deferred took more than 0 to execute.\n'
+            'Reactor trace for last ',
+            context.exception.args[0],
+            )
+        self._reactor_timeout_failure = None
+
+    def test_runDeferred_no_debug(self):
+        """
+        Without debug mode, no trace is recorded.
+        """
+        self.runDeferred(defer.succeed(None))
+
+        self.assertEqual(0, len(self._reactor_trace))
+        self.assertEqual('', self._getReactorTrace())
+
+
+class TestTwistedTestCaseWatchdog(EmpiricalTestCase):
+    """
+    Tests for interrupting tests which take longer than TEST_TIMEOUT.
+    """
+
+    def runInnerTest(self, test_method, result=None):
+        """
+        Run `test_method` as a separate test with a timeout and return the
+        test result.
+        """
+        class InnerTest(EmpiricalTestCase):
+            TEST_TIMEOUT = 0.1
+
+            def test_inner(self):
+                test_method()
+
+        if result is None:
+            result = unittest.TestResult()
+        InnerTest('test_inner').run(result)
+        return result
+
+    @conditionals.onOSFamily('posix')
+    def test_timeout(self):
+        """
+        A test blocked outside of the reactor fails once the timeout is
+        reached, and the failure contains the stacks of the other threads.
+        """
+        handler = signal.getsignal(signal.SIGALRM)
+        start = time.time()
+
+        with self.patch('sys.stderr') as mock_stderr:
+            result = self.runInnerTest(lambda: time.sleep(5))
+
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(mock_stderr.write.called)
+        self.assertEqual(1, len(result.failures))
+        message = result.failures[0][1]
+        self.assertContains(
+            'Test took more than 0.1 seconds to execute.', message)
+        self.assertContains('Thread MainThread:', message)
+        self.assertIs(handler, signal.getsignal(signal.SIGALRM))
+
+    def test_timeout_without_signal(self):
+        """
+        Without SIGALRM, the test is not interrupted and the timeout is
+        only reported on stderr.
+        """
+        with self.patchObject(testcase, 'signal', object()):
+            with self.patch('sys.stderr') as mock_stderr:
+                result = self.runInnerTest(lambda: time.sleep(0.3))
+
+        self.assertTrue(result.wasSuccessful())
+        message = mock_stderr.write.call_args[0][0]
+        self.assertStartsWith(
+            'Test took more than 0.1 seconds to execute.', message)
+
+    @conditionals.onOSFamily('posix')
+    def test_timeout_while_recording_outcome(self):
+        """
+        The test is not interrupted once tearDown is done, while the outcome
+        of the test is recorded.
+        """
+        class SlowResult(unittest.TestResult):
+            def addSuccess(self, test):
+                time.sleep(0.3)
+                super(SlowResult, self).addSuccess(test)
+
+        handler = signal.getsignal(signal.SIGALRM)
+
+        with self.patch('sys.stderr') as mock_stderr:
+            result = self.runInnerTest(lambda: None, result=SlowResult())
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(1, result.testsRun)
+        self.assertTrue(mock_stderr.write.called)
+        self.assertIs(handler, signal.getsignal(signal.SIGALRM))
+
+    def test_timeout_setUp_failure(self):
+        """
+        The test is not interrupted while the setUp failure is recorded.
+        """
+        class InnerTest(EmpiricalTestCase):
+            TEST_TIMEOUT = 0.1
+
+            def setUp(self):
+                super(InnerTest, self).setUp()
+                raise RuntimeError('setup-error')
+
+            def test_inner(self):  # pragma: no cover
+                pass
+
+        class SlowResult(unittest.TestResult):
+            def addError(self, test, error):
+                time.sleep(0.3)
+                super(SlowResult, self).addError(test, error)
+
+        result = SlowResult()
+
+        with self.patch('sys.stderr'):
+            InnerTest('test_inner').run(result)
+
+        self.assertEqual(1, len(result.errors))
+        self.assertContains('setup-error', result.errors[0][1])
+
+    def test_no_timeout(self):
+        """
+        A test finishing before the timeout is not interrupted.
+        """
+        result = self.runInnerTest(lambda: None)
+        time.sleep(0.2)
+
+        self.assertTrue(result.wasSuccessful())
+
+
+class TestTwistedTestCaseDeferredProfiler(EmpiricalTestCase):
+    """
+    Tests for recording the timeline of the deferred callbacks.
+    """
+
+    DEFERRED_PROFILER = True
+
+    def test_getDeferredResult(self):
+        """
+        Each callback is recorded, including the callbacks of the
+        deferreds returned by other callbacks.
+        """
+        nested = defer.Deferred()
+
+        def first(result):
+            time.sleep(0.01)
+            return result + 1
+
+        def second(result):
+            reactor.callLater(0.01, nested.callback, result + 1)
+            return nested
+
+        def nested_callback(result):
+            return result + 1
+
+        def third(result):
+            return result + 1
+
+        nested.addCallback(nested_callback)
+        deferred = defer.Deferred()
+        deferred.addCallback(first)
+        deferred.addCallback(second)
+        deferred.addCallback(third)
+        reactor.callLater(0, deferred.callback, 0)
+
+        result = self.getDeferredResult(deferred)
+
+        self.assertEqual(4, result)
+        timeline = self._deferred_profiler.timeline
+        self.assertEqual(
+            [
+                (u'first', 0),
+                (u'second', 0),
+                (u'nested_callback', 1),
+                (u'third', 0),
+                ],
+            [(entry.name, entry.depth) for entry in timeline],
+            )
+        self.assertLessEqual(0.01, timeline[0].duration)
+        self.assertLess(0, timeline[0].iterations)
+        # The nested deferred is called by the reactor.
+        self.assertLessEqual(0.005, timeline[2].waited)
+        self.assertLess(0, timeline[2].iterations)
+        self.assertEqual(0, timeline[3].iterations)
+
+    def test_runDeferred_timeout(self):
+        """
+        The timeline is included in the timeout error.
+        """
+        deferred = defer.Deferred()
+        deferred.addCallback(lambda _: defer.Deferred())
+        reactor.callLater(0, deferred.callback, None)
+
+        with self.assertRaises(AssertionError) as context:
+            self.runDeferred(deferred, timeout=0.05)
+
+        message = context.exception.args[0]
+        self.assertStartsWith(
+            u'Deferred took more than 0 to execute.\n'
+            u'Deferred chain timeline:\n'
+            u'  <lambda>: ',
+            message,
+            )
+        self._reactor_timeout_failure = None
+
+
+class TestTwistedTestCaseOutcome(EmpiricalTestCase):
+    """
+    Tests for recording the outcome of the test method.
+    """
+
+    def runInnerTest(self, test_method):
+        """
+        Run `test_method` as a separate test and return the success state
+        seen in tearDown.
+        """
+        states = []
+
+        class InnerTest(EmpiricalTestCase):
+            def tearDown(self):
+                states.append(self._caller_success_member)
+                super(InnerTest, self).tearDown()
+
+            def test_inner(self):
+                test_method()
+
+        with self.patch('inspect.stack') as mock_stack:
+            InnerTest('test_inner').run(unittest.TestResult())
+
+        self.assertFalse(mock_stack.called)
+        return states
+
+    def test_caller_success_member_success(self):
+        """
+        When test method succeeds, the success state is True in tearDown.
+        """
+        states = self.runInnerTest(lambda: None)
+
+        self.assertEqual([True], states)
+
+    def test_caller_success_member_failure(self):
+        """
+        When test method fails, the success state is False in tearDown.
+        """
+        def fail():
+            raise AssertionError('Failure.')
+
+        states = self.runInnerTest(fail)
+
+        self.assertEqual([False], states)
+
+
+class TestTwistedTestCaseReactorSession(EmpiricalTestCase):
+    """
+    Tests for keeping the reactor running for a whole session.
+    """
+
+    def runInnerTests(self, session, *test_methods):
+        """
+        Run `test_methods` as tests from a separate class using reactor
+        `session` and return the test result.
+        """
+        class InnerTest(EmpiricalTestCase):
+            REACTOR_SESSION = session
+
+        for index, test_method in enumerate(test_methods):
+            setattr(InnerTest, 'test_%d' % (index,), test_method)
+
+        suite = unittest.TestSuite([
+            InnerTest('test_%d' % (index,))
+            for index in range(len(test_methods))
+            ])
+        result = unittest.TestResult()
+        with self.patchObject(
+                reactor, 'startRunning', wraps=reactor.startRunning,
+                ) as mock_start:
+            suite.run(result)
+        self.assertFalse(reactor._started)
+        return result, mock_start.call_count
+
+    def test_test_session(self):
+        """
+        With a test session, the reactor is started once for each test and
+        is stopped at the end of the test.
+        """
+        started = []
+
+        def test_method(test):
+            test.runDeferred(defer.succeed(None))
+            started.append(reactor._started)
+            test.runDeferred(defer.succeed(None))
+            test.executeReactor()
+
+        result, start_count = self.runInnerTests(
+            'test', test_method, test_method)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual([True, True], started)
+        self.assertEqual(2, start_count)
+
+    def test_test_session_not_clean(self):
+        """
+        With a test session, the reactor is checked at the end of the test.
+        """
+        def test_method(test):
+            test.runDeferred(defer.succeed(None))
+            reactor.callLater(10, lambda: None)
+
+        result, _ = self.runInnerTests('test', test_method)
+
+        self.assertEqual(1, len(result.errors) + len(result.failures))
+        self.assertEqual([], reactor.getDelayedCalls())
+
+    def test_class_session(self):
+        """
+        With a class session, the reactor is started once for all tests
+        from the class.
+        """
+        def test_method(test):
+            test.runDeferred(defer.succeed(None))
+            test.executeReactor()
+
+        result, start_count = self.runInnerTests(
+            'class', test_method, test_method, test_method)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(1, start_count)
+
+    def test_class_session_not_clean(self):
+        """
+        With a class session, the reactor is checked only after all tests
+        from the class.
+        """
+        def leave_call(test):
+            test.runDeferred(defer.succeed(None))
+            reactor.callLater(10, lambda: None)
+
+        def run_deferred(test):
+            test.runDeferred(defer.succeed(None))
+
+        result, _ = self.runInnerTests('class', leave_call, run_deferred)
+
+        self.assertEqual(2, result.testsRun)
+        self.assertEqual(0, len(result.failures))
+        # The error is reported for the class.
+        self.assertEqual(1, len(result.errors))
+        self.assertEqual([], reactor.getDelayedCalls())
+
+
+class TestTwistedTestCaseInstrumentation(EmpiricalTestCase):
+    """
+    Tests for TwistedTestCase when recording the time spent by the reactor.
+    """
+
+    REACTOR_INSTRUMENTATION = True
+    REACTOR_SLOW_CALL = 0.01
+
+    def test_executeReactor(self):
+        """
+        The iterations, the delayed calls and the slow delayed calls are
+        recorded.
+        """
+        def slow_call():
+            time.sleep(0.02)
+
+        def fast_call():
+            pass
+
+        reactor.callLater(0, slow_call)
+        reactor.callLater(0, fast_call)
+
+        self.executeReactor()
+
+        instrumentation = self._reactor_instrumentation
+        self.assertLess(0, instrumentation.iterations)
+        self.assertEqual(2, instrumentation.delayed_calls)
+        self.assertLessEqual(0.02, instrumentation.run_until_current)
+        self.assertEqual(1, len(instrumentation.slow_calls))
+        name, duration = instrumentation.slow_calls[0]
+        self.assertEqual(u'slow_call', name)
+        self.assertLessEqual(0.02, duration)
+        iteration_times = instrumentation.iteration_times
+        self.assertEqual(instrumentation.iterations, len(iteration_times))
+        self.assertEqual(
+            2, sum(calls for _, _, calls in iteration_times))
+        self.assertEqual(
+            instrumentation.do_iteration,
+            sum(duration for _, duration, _ in iteration_times))
+
+    def test_iteration_times_size(self):
+        """
+        The times are only kept for the last iterations.
+        """
+        instrumentation = testcase._ReactorInstrumentation(
+            reactor, slow_call=1, size=2)
+
+        for timeout in range(3):
+            instrumentation.doIteration(lambda timeout: None, timeout)
+
+        self.assertEqual(3, instrumentation.iterations)
+        self.assertEqual(2, len(instrumentation.iteration_times))
+
+    def test_delayed_call_not_due(self):
+        """
+        Delayed calls which are not due are left unchanged.
+        """
+        def later():  # pragma: no cover
+            """
+            This is here to have a name.
+            """
+
+        delayed_call = reactor.callLater(10, later)
+
+        self.runDeferred(defer.succeed(None))
+
+        self.assertIs(later, delayed_call.func)
+        self.assertEqual(0, self._reactor_instrumentation.delayed_calls)
+        delayed_call.cancel()
+
+    def test_tearDown_report(self):
+        """
+        At the end of the test a report is added to the reactor reports.
+        """
+        class InnerTest(EmpiricalTestCase):
+            REACTOR_INSTRUMENTATION = True
+
+            def test_inner(self):
+                pass
+
+        reports = testcase.reactor_reports
+        reports.clear()
+        test = InnerTest('test_inner')
+        result = unittest.TestResult()
+
+        test.run(result)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(1, len(reports))
+        report = reports.pop()
+        self.assertEqual(test.id(), report.test_id)
+        self.assertEqual(0, report.iterations)
+        self.assertEqual([], report.iteration_times)
+
+
+class TestTwistedTestCaseSynchronousThreadPool(EmpiricalTestCase):
+    """
+    Tests for TwistedTestCase when using a synchronous thread pool.
+    """
+
+    SYNCHRONOUS_THREAD_POOL = True
+
+    def test_deferToThread(self):
+        """
+        Jobs are executed in the reactor thread, on the next reactor
+        iteration, without starting new threads.
+        """
+        calls = []
+
+        def job(value):
+            calls.append(threading.current_thread())
+            return value
+
+        with self.patchObject(threading.Thread, 'start') as mock_start:
+            deferred = threads.deferToThread(job, 'ok')
+            self.assertEqual([], calls)
+
+            result = self.getDeferredResult(deferred)
+
+        self.assertEqual('ok', result)
+        self.assertEqual([threading.current_thread()], calls)
+        self.assertFalse(mock_start.called)
+        # The pool is kept after the reactor is stopped.
+        self.assertIs(self._synchronous_thread_pool, reactor.threadpool)
+
+    def test_deferToThread_failure(self):
+        """
+        Errors from the jobs are returned as failures.
+        """
+        def job():
+            raise RuntimeError('bad')
+
+        deferred = threads.deferToThread(job)
+
+        failure = self.getDeferredFailure(deferred)
+
+        self.assertFailureType(RuntimeError, failure)
+
+    def test_callInThread(self):
+        """
+        Jobs without a result are executed by executeReactor.
+        """
+        calls = []
+
+        reactor.callInThread(calls.append, 'first')
+        reactor.callInThread(calls.append, 'second')
+        self.assertEqual(2, self._threadPoolQueueSize())
+
+        self.executeReactor()
+
+        self.assertEqual(['first', 'second'], calls)
+        self.assertEqual(0, self._threadPoolQueueSize())
+
+
+class FakeEventLoop(object):
+    """
+    Event loop recording how it was run, to help with testing.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def call_later(self, delay, callback):
+        self.calls.append(('call_later', delay))
+        return self
+
+    def cancel(self):
+        self.calls.append(('cancel',))
+
+    def run_forever(self):
+        self.calls.append(('run_forever',))
+
+    def stop(self):
+        self.calls.append(('stop',))
+
+
+class TestTwistedTestCaseBlockingReactor(EmpiricalTestCase):
+    """
+    Tests for TwistedTestCase when reactor is blocking while waiting for
+    events.
+    """
+
+    BLOCKING_REACTOR = True
+
+    def test_runDeferred_delayed_call(self):
+        """
+        runDeferred will wait in the reactor for the next delayed call,
+        instead of continuously iterating the reactor.
+        """
+        deferred = defer.Deferred()
+        reactor.callLater(0.1, lambda d: d.callback('ok'), deferred)
+
+        with self.patchObject(
+                reactor, 'doIteration', wraps=reactor.doIteration,
+                ) as mock_iteration:
+            self.runDeferred(deferred, timeout=1)
+
+        self.assertEqual('ok', deferred.result)
+        # When polling, the reactor is iterated thousands of times.
+        self.assertLess(mock_iteration.call_count, 10)
+
+    def test_doTestReactorIteration_asyncio_timeout(self):
+        """
+        The asyncio event loop runs until the timeout, instead of being
+        iterated without waiting.
+        """
+        loop = FakeEventLoop()
+        reactor._asyncioEventloop = loop
+        try:
+            self._doTestReactorIteration(0.5)
+        finally:
+            del reactor._asyncioEventloop
+
+        self.assertEqual(
+            [('call_later', 0.5), ('run_forever',), ('cancel',)],
+            loop.calls,
+            )
+
+    def test_doTestReactorIteration_asyncio_no_wait(self):
+        """
+        Without a timeout, the asyncio event loop is only iterated once,
+        and waking the reactor stops the event loop.
+        """
+        loop = FakeEventLoop()
+        reactor._asyncioEventloop = loop
+        try:
+            self._doTestReactorIteration(False)
+            self._wakeTestReactor(None)
+        finally:
+            del reactor._asyncioEventloop
+
+        self.assertEqual(
+            [('stop',), ('run_forever',), ('stop',)], loop.calls)
+
+    def test_runDeferred_called_outside_reactor(self):
+        """
+        The reactor is woken as soon as the deferred is called, even when
+        it is called from outside of the reactor.
+        """
+        deferred = defer.Deferred()
+        caller = threading.Timer(0.05, deferred.callback, args=('ok',))
+        start = time.time()
+        caller.start()
+
+        self.runDeferred(deferred, timeout=5)
+
+        caller.join()
+        self.assertEqual('ok', deferred.result)
+        self.assertLess(time.time() - start, 0.5)
+
+
+class TestTwistedTestCaseVirtualTime(EmpiricalTestCase):
+    """
+    Tests for TwistedTestCase when using a virtual clock.
+    """
+
+    VIRTUAL_TIME = True
+
+    def test_executeReactor_delayed_calls(self):
+        """
+        It will execute the delayed calls, including chained delayed calls,
+        without waiting for them in wall time.
+        """
+        self.called = False
+
+        def last_call():
+            self.called = True
+        reactor.callLater(10, lambda: reactor.callLater(20, last_call))
+        start = time.time()
+
+        self.executeReactor(timeout=60)
+
+        self.assertTrue(self.called)
+        self.assertLess(time.time() - start, 1)
+
+    def test_runDeferred_delayed_call(self):
+        """
+        runDeferred will move the clock to the delayed call which
+        fires the deferred.
+        """
+        deferred = defer.Deferred()
+        reactor.callLater(5, lambda d: d.callback('ok'), deferred)
+        start = time.time()
+        virtual_start = reactor.seconds()
+
+        self.runDeferred(deferred, timeout=10)
+
+        self.assertEqual('ok', deferred.result)
+        self.assertLess(time.time() - start, 1)
+        self.assertGreaterEqual(reactor.seconds() - virtual_start, 5)
+
+    def test_runDeferred_timeout(self):
+        """
+        The timeout is measured in virtual time.
+        """
+        deferred = defer.Deferred()
+        start = time.time()
+
+        with self.assertRaises(AssertionError) as context:
+            self.runDeferred(deferred, timeout=30)
 
-        self.assertReactorIsClean()
-        # Cancel and remove it so that other tests will not fail.
-        delayed_call.cancel()
-        self.executeReactor()
+        self.assertEqual(
+            'Deferred took more than 30 to execute.',
+            context.exception.args[0]
+            )
+        self.assertLess(time.time() - start, 1)
+        # Restore order order messing with internal timeout state in
+        # previous state.
+        self._reactor_timeout_failure = None
 
 
 class TestEmpiricalTestCase(EmpiricalTestCase):
@@ -400,6 +1420,104 @@ class TestEmpiricalTestCase(EmpiricalTestCase):
 
         self.assertFalse(mk.fs.exists(temp_segments))
 
+    def test_assertTempIsClean_names(self):
+        """
+        When names are provided, only the members with these names are
+        checked.
+        """
+        temp_segments = mk.fs.createFileInTemp()
+        self.addCleanup(mk.fs.deleteFile, temp_segments)
+
+        self.assertTempIsClean(names=set())
+        self.assertTempIsClean(names=set([mk.makeFilename()]))
+        self.assertTrue(mk.fs.exists(temp_segments))
+
+        with self.assertRaises(AssertionError) as context:
+            self.assertTempIsClean(names=set([temp_segments[-1]]))
+
+        message = context.exception.args[0].decode('utf-8')
+        self.assertContains(temp_segments[-1], message)
+        self.assertFalse(mk.fs.exists(temp_segments))
+        # Put it back for the cleanup.
+        mk.fs.createFile(temp_segments)
+
+    def test_checkTemporaryFiles_generated_names(self):
+        """
+        At the end of the test, the names generated during the test are
+        checked in the temporary folder.
+        """
+        temp_segments = mk.fs.createFileInTemp()
+
+        with self.assertRaises(AssertionError) as context:
+            self._checkTemporaryFiles()
+
+        message = context.exception.args[0].decode('utf-8')
+        self.assertContains(temp_segments[-1], message)
+        self.assertFalse(mk.fs.exists(temp_segments))
+
+    def test_checkTemporaryFiles_derived_names(self):
+        """
+        The files named as a name generated during the test with a suffix
+        recorded by the factory are also found.
+        """
+        name = mk.makeFilename()
+        temp_segments = mk.fs.temp_segments + [name + u'.lock']
+        mk.fs.createFile(temp_segments)
+
+        with self.patchObject(mockup, '_derived_suffixes', set()):
+            mk.recordDerivedSuffix(u'.lock')
+            with self.assertRaises(AssertionError) as context:
+                self._checkTemporaryFiles()
+
+        message = context.exception.args[0].decode('utf-8')
+        self.assertContains(name + u'.lock', message)
+        self.assertFalse(mk.fs.exists(temp_segments))
+
+    def test_checkTemporaryFiles_no_listing(self):
+        """
+        The folders are not listed, only the generated names are checked.
+        """
+        mk.makeFilename()
+
+        with self.patchObject(
+                testcase.LocalFilesystem, 'getFolderContent',
+                ) as mock_content:
+            self._checkTemporaryFiles()
+
+        self.assertFalse(mock_content.called)
+
+    def test_getCurrentMemoryUsage(self):
+        """
+        The current memory usage is returned in kilo bytes and is not
+        higher than the peak memory usage.
+        """
+        result = self.getCurrentMemoryUsage()
+
+        self.assertLess(0, result)
+        self.assertLessEqual(result, self.getPeakMemoryUsage())
+        self.assertLessEqual(result, self.getPeakMemoryUsageSinceReset())
+
+    @conditionals.onOSName('linux')
+    def test_resetPeakMemoryUsage(self):
+        """
+        On Linux, the peak memory usage is reset to the current memory
+        usage.
+        """
+        data = b'a' * 50 * 1024 * 1024
+        del data
+
+        process_peak = self.getPeakMemoryUsage()
+
+        result = self.resetPeakMemoryUsage()
+
+        self.assertTrue(result)
+        self.assertLess(
+            self.getPeakMemoryUsageSinceReset(),
+            self.getCurrentMemoryUsage() + 40 * 1024,
+            )
+        # The peak of the whole process is not reset.
+        self.assertLessEqual(process_peak, self.getPeakMemoryUsage())
+
     def test_patch(self):
         """
         It can be used for patching classes.
@@ -463,6 +1581,19 @@ class TestEmpiricalTestCase(EmpiricalTestCase):
 
             self.assertIsListening(address, port)
 
+    def test_listenPort_free_port(self):
+        """
+        When no port is provided, it listens on a free port.
+        """
+        address = '127.0.0.1'
+
+        with self.listenPort(address) as port:
+
+            self.assertIsListening(address, port)
+
+        self.assertEqual(
+            [port], testcase.allocator.allocated[self._ports_start:])
+
     def test_listenPort_on_loopback_alias(self):
         """
         Integration test to check that we can listen on loopback alias.
@@ -483,6 +1614,74 @@ class TestEmpiricalTestCase(EmpiricalTestCase):
 
             self.assertIsListening(address, port)
 
+    def getListeningSocket(self, listen=True):
+        """
+        Return a socket bound on the loopback address, which is listening
+        when `listen` is True.
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        if listen:
+            server.listen(5)
+        return server
+
+    def test_waitForListening(self):
+        """
+        No error is raised when all addresses are listening.
+        """
+        addresses = [
+            self.getListeningSocket().getsockname() for _ in range(3)]
+
+        self.waitForListening(addresses)
+
+    def test_waitForListening_delayed(self):
+        """
+        The addresses are probed again until they are listening.
+        """
+        server = self.getListeningSocket(listen=False)
+        timer = threading.Timer(0.05, server.listen, args=(5,))
+        timer.start()
+
+        self.waitForListening([server.getsockname()])
+
+        timer.join()
+
+    def test_waitForListening_not_listening(self):
+        """
+        An error is raised with the addresses which are not listening
+        after the timeout.
+        """
+        listening = self.getListeningSocket().getsockname()
+        not_listening = self.getListeningSocket(listen=False).getsockname()
+
+        with self.assertRaises(AssertionError) as context:
+            self.waitForListening([listening, not_listening], timeout=0.05)
+
+        self.assertEqual(
+            'It seems that no one is listening on 127.0.0.1:%d' % (
+                not_listening[1],),
+            context.exception.args[0],
+            )
+
+    def test_assertIsNotListening(self):
+        """
+        No error is raised when the address refuses connections, and an
+        error is raised when it accepts connections.
+        """
+        listening = self.getListeningSocket().getsockname()
+        not_listening = self.getListeningSocket(listen=False).getsockname()
+
+        self.assertIsNotListening(*not_listening)
+        with self.assertRaises(AssertionError) as context:
+            self.assertIsNotListening(*listening)
+
+        self.assertEqual(
+            'It seems that someone is listening on 127.0.0.1:%d' % (
+                listening[1],),
+            context.exception.args[0],
+            )
+
     def check_assertWorkingFolderIsClean(self, content):
         """
         Common tests for assertWorkingFolderIsClean.
@@ -663,6 +1862,428 @@ class TestEmpiricalTestCase(EmpiricalTestCase):
             'Iterable is not empty.\n(1, 2).', context.exception.args[0])
 
 
+class TestEmpiricalTestCaseThreads(EmpiricalTestCase):
+    """
+    Tests for the check of the threads started by the test.
+    """
+
+    THREAD_JOIN_TIMEOUT = 0.05
+
+    def test_checkThreads_leaked(self):
+        """
+        A thread started by the test which is still running is reported
+        together with the place from where it was started.
+        """
+        event = threading.Event()
+        thread = threading.Thread(target=event.wait, name='leaky-thread')
+        thread.start()
+        self.addCleanup(event.set)
+        self.addCleanup(thread.join)
+
+        with self.assertRaises(AssertionError) as context:
+            self._checkThreads()
+
+        message = context.exception.args[0]
+        self.assertStartsWith(
+            'There are still active threads, beside the main thread: '
+            'leaky-thread',
+            message,
+            )
+        self.assertContains('test_checkThreads_leaked', message)
+        self.assertContains('thread.start()', message)
+
+    def test_checkThreads_grace(self):
+        """
+        Threads which stop during the join timeout are not reported.
+        """
+        thread = threading.Thread(target=time.sleep, args=(0.01,))
+        thread.start()
+
+        self._checkThreads()
+
+        self.assertFalse(thread.is_alive())
+
+    def test_checkThreads_excepted(self):
+        """
+        Threads with excepted names are not checked.
+        """
+        event = threading.Event()
+        thread = threading.Thread(
+            target=event.wait, name=testcase.WATCHDOG_THREAD_NAME)
+        thread.start()
+        self.addCleanup(event.set)
+        self.addCleanup(thread.join)
+
+        self._checkThreads()
+
+        self.assertTrue(thread.is_alive())
+
+
+class TestEmpiricalTestCaseDeferredCleanup(EmpiricalTestCase):
+    """
+    Tests for cleanup methods returning deferreds.
+    """
+
+    def test_callCleanup_concurrent(self):
+        """
+        The deferreds returned by the cleanup methods are run together,
+        after all cleanup methods were called.
+        """
+        first = defer.Deferred()
+        second = defer.Deferred()
+        first.addCallback(lambda _: second.callback('second'))
+
+        def cleanup_first():
+            return first
+
+        def cleanup_second():
+            # The first deferred can only fire after this is called.
+            reactor.callLater(0, first.callback, 'first')
+            return second
+
+        self.addCleanup(cleanup_first)
+        self.addCleanup(cleanup_second)
+
+        self.callCleanup()
+
+        self.assertTrue(first.called)
+        self.assertEqual('second', second.result)
+
+    def test_callCleanup_failure(self):
+        """
+        An error is raised after all cleanup methods were called, when any
+        of the deferreds has failed.
+        """
+        calls = []
+        self.addCleanup(defer.fail, RuntimeError('close-error'))
+        self.addCleanup(calls.append, 'called')
+
+        with self.assertRaises(AssertionError) as context:
+            self.callCleanup()
+
+        self.assertEqual(['called'], calls)
+        self.assertStartsWith('Cleanup failed:', context.exception.args[0])
+        self.assertContains('close-error', context.exception.args[0])
+
+    def test_callCleanup_timeout(self):
+        """
+        When a deferred returned by a cleanup method times out, the test
+        fails and the next test still finds a clean reactor.
+        """
+        patches = []
+
+        class InnerTest(EmpiricalTestCase):
+            CLEANUP_TIMEOUT = 0.1
+
+            def test_1_timeout(self):
+                reactor.callLater(10, lambda: None)
+                self.addCleanup(defer.Deferred)
+
+            def test_2_next(self):
+                patches.append(reactor.__dict__.get('callLater', None))
+                self.assertReactorIsClean()
+                self.assertEqual([], self._reactor_tracker.delayed_calls)
+
+        callLater = reactor.__dict__.get('callLater', None)
+        suite = unittest.TestLoader().loadTestsFromTestCase(InnerTest)
+        result = unittest.TestResult()
+
+        suite.run(result)
+
+        # Errors from tearDown are reported as errors.
+        self.assertEqual(1, len(result.errors))
+        test, message = result.errors[0]
+        self.assertEqual('test_1_timeout', test._testMethodName)
+        self.assertContains('Deferred took more than', message)
+        self.assertEqual([], result.failures)
+        self.assertEqual(2, result.testsRun)
+        # The second test has its own tracker.
+        self.assertIsNot(callLater, patches[0])
+        self.assertEqual(callLater, reactor.__dict__.get('callLater', None))
+        self.assertReactorIsClean()
+
+
+class TestEmpiricalTestCaseTearDown(EmpiricalTestCase):
+    """
+    Tests for restoring the reactor and the threads when tearDown or setUp
+    fails.
+    """
+
+    def getPatches(self):
+        """
+        Return the reactor and thread methods replaced by the tests.
+        """
+        return [
+            reactor.__dict__.get('callLater', None),
+            reactor.__dict__.get('addReader', None),
+            reactor.__dict__.get('getThreadPool', None),
+            threading.Thread.__dict__['start'],
+            ]
+
+    def test_tearDown_cleanup_failure(self):
+        """
+        When a cleanup fails, the reactor is still cleaned and restored,
+        and the cleanup error is reported.
+        """
+        delayed_calls = []
+
+        class InnerTest(EmpiricalTestCase):
+            def test_inner(self):
+                delayed_calls.append(reactor.callLater(10, lambda: None))
+
+                def cleanup():
+                    raise RuntimeError('cleanup-error')
+
+                self.addCleanup(cleanup)
+
+        patches = self.getPatches()
+        result = unittest.TestResult()
+
+        InnerTest('test_inner').run(result)
+
+        self.assertEqual(1, len(result.errors))
+        self.assertContains('cleanup-error', result.errors[0][1])
+        self.assertFalse(delayed_calls[0].active())
+        self.assertEqual(patches, self.getPatches())
+
+    def test_tearDown_cleanup_failure_ports(self):
+        """
+        When a cleanup fails, the ports allocated during the test are still
+        released.
+        """
+        ports = []
+
+        class InnerTest(EmpiricalTestCase):
+            def test_inner(self):
+                ports.append(mk.getFreePort())
+                self.addCleanup(defer.fail, RuntimeError('cleanup-error'))
+
+        allocated = testcase.allocator.allocated[:]
+        result = unittest.TestResult()
+
+        InnerTest('test_inner').run(result)
+
+        self.assertEqual(1, len(result.errors))
+        self.assertEqual(allocated, testcase.allocator.allocated)
+        self.assertFalse(ports[0] in testcase.allocator._reserved)
+
+    def test_setUp_failure(self):
+        """
+        When setUp fails, tearDown is not called, but the reactor and the
+        threads are still restored.
+        """
+        class InnerTest(EmpiricalTestCase):
+            VIRTUAL_TIME = True
+
+            def setUp(self):
+                super(InnerTest, self).setUp()
+                self._startVirtualTime()
+                raise RuntimeError('setup-error')
+
+            def test_inner(self):  # pragma: no cover
+                pass
+
+        patches = self.getPatches()
+        result = unittest.TestResult()
+
+        InnerTest('test_inner').run(result)
+
+        self.assertEqual(1, len(result.errors))
+        self.assertContains('setup-error', result.errors[0][1])
+        self.assertEqual(patches, self.getPatches())
+        self.assertFalse('seconds' in reactor.__dict__)
+
+
+class TestEmpiricalTestCaseFixture(EmpiricalTestCase):
+    """
+    Tests for fixtures shared between tests.
+    """
+
+    def test_fixture_test_scope(self):
+        """
+        By default, the fixture is created once for the test and the
+        cleanup is called at the end of the test.
+        """
+        released = []
+
+        def create():
+            return object()
+
+        first = self.fixture(create, cleanup=released.append)
+        second = self.fixture(create, cleanup=released.append)
+
+        self.assertIs(first, second)
+        self.assertEqual([], released)
+        self.callCleanup()
+        self.assertEqual([first], released)
+
+    def test_fixture_class_scope(self):
+        """
+        A class fixture is kept after the test, and the files created by
+        it are not checked at the end of the test.
+        """
+        released = []
+
+        def create():
+            return mk.fs.createFolderInTemp()
+
+        def cleanup(segments):
+            released.append(segments)
+            mk.fs.deleteFolder(segments)
+
+        result = self.fixture(create, scope='class', cleanup=cleanup)
+
+        self.assertIs(result, self.fixture(create, scope='class'))
+        self.assertFalse(result[-1] in mk.popGeneratedNames())
+        self.assertEqual([], released)
+        testcase._fixtures.release(scope='class', owner=self.__class__)
+        self.assertEqual([result], released)
+        self.assertFalse(mk.fs.exists(result))
+
+    def test_fixture_unknown_scope(self):
+        """
+        An error is raised for an unknown scope.
+        """
+        with self.assertRaises(AssertionError) as context:
+            self.fixture(object, scope='other')
+
+        self.assertEqual(
+            'Unknown fixture scope: other', context.exception.args[0])
+
+    def test_FixtureCache_evict(self):
+        """
+        The least recently used fixtures are released until their size is
+        not over the memory cap, skipping the ones used by the current
+        test.
+        """
+        sut = testcase._FixtureCache()
+        for name in ['first', 'second', 'third']:
+            sut.add(name, testcase._Fixture(name, 10, None, 'other_test'))
+        sut.get('first', 'other_test')
+        sut.get('third', 'current_test')
+
+        result = sut.evict(15, 'current_test')
+
+        self.assertEqual(
+            ['second', 'first'], [fixture.value for fixture in result])
+        self.assertIsNotNone(sut.get('third', 'current_test'))
+        self.assertIsNone(sut.get('first', 'current_test'))
+
+    def test_fixture_evict(self):
+        """
+        The cleanups of the evicted fixtures are called at the end of the
+        test which evicted them.
+        """
+        released = []
+
+        class InnerTest(EmpiricalTestCase):
+            FIXTURE_MEMORY_CAP = 15
+
+            def test_1_first(self):
+                self.fixture(
+                    lambda: 'first', scope='session', key='evict-first',
+                    cleanup=released.append, size=10)
+
+            def test_2_second(self):
+                self.fixture(
+                    lambda: 'second', scope='session', key='evict-second',
+                    cleanup=released.append, size=10)
+                released.append('test-end')
+
+        result = unittest.TestResult()
+
+        unittest.TestSuite([
+            InnerTest('test_1_first'), InnerTest('test_2_second'),
+            ]).run(result)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(['test-end', 'first'], released)
+        testcase._fixtures.release(scope='session', owner=None)
+        self.assertEqual(['test-end', 'first', 'second'], released)
+
+    def test_FixtureCache_release_failure(self):
+        """
+        All cleanups are called when some of them fail, and the errors are
+        raised at the end.
+        """
+        released = []
+
+        def cleanup(value):
+            released.append(value)
+            raise RuntimeError('cleanup-' + value)
+
+        sut = testcase._FixtureCache()
+        for name in ['first', 'second', 'third']:
+            sut.add(('class', None, name), testcase._Fixture(
+                name, 10, cleanup, 'other_test'))
+
+        with self.assertRaises(AssertionError) as context:
+            sut.release()
+
+        self.assertEqual(['first', 'second', 'third'], released)
+        message = context.exception.args[0]
+        self.assertStartsWith('Failed to release fixtures:', message)
+        self.assertContains('cleanup-first', message)
+        self.assertContains('cleanup-third', message)
+        # Nothing is left to be released.
+        sut.release()
+        self.assertEqual(3, len(released))
+
+    def test_FixtureCache_release_deferred(self):
+        """
+        The deferreds returned by the cleanups are executed, and their
+        failures are raised.
+        """
+        released = []
+
+        def cleanup(value):
+            deferred = defer.Deferred()
+            deferred.addCallback(released.append)
+            reactor.callLater(0.01, deferred.callback, value)
+            return deferred
+
+        def fail(value):
+            return defer.fail(RuntimeError('cleanup-' + value))
+
+        sut = testcase._FixtureCache()
+        sut.add(('class', None, 'first'), testcase._Fixture(
+            'first', 10, cleanup, 'other_test'))
+        sut.add(('class', None, 'second'), testcase._Fixture(
+            'second', 10, fail, 'other_test'))
+
+        with self.assertRaises(AssertionError) as context:
+            sut.release()
+
+        self.assertEqual(['first'], released)
+        self.assertContains('cleanup-second', context.exception.args[0])
+
+    def test_fixture_module_scope(self):
+        """
+        The module fixtures are released by the tearDownModule of the
+        module, calling the existing tearDownModule.
+        """
+        module = types.ModuleType('fixture_module')
+        calls = []
+        module.tearDownModule = lambda: calls.append('previous')
+        sys.modules['fixture_module'] = module
+        self.addCleanup(sys.modules.pop, 'fixture_module')
+
+        class InnerTest(EmpiricalTestCase):
+            def test_inner(self):
+                self.fixture(
+                    lambda: 'value', scope='module',
+                    cleanup=calls.append)
+
+        InnerTest.__module__ = 'fixture_module'
+        result = unittest.TestResult()
+        InnerTest('test_inner').run(result)
+
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual([], calls)
+        module.tearDownModule()
+        self.assertEqual(['previous', 'value'], calls)
+
+
 @conditionals.onOSFamily('posiX')
 class TestClassConditionalsPosix(EmpiricalTestCase):
     """
@@ -774,3 +2395,62 @@ class TestEmpiricalTestCaseCallCleanup(EmpiricalTestCase):
         # Calling again produce no changes.
         self.callCleanup()
         self.assertEqual(1, self.cleanup_call_count)
+
+
+class TestImport(EmpiricalTestCase):
+    """
+    Tests for the dependencies loaded when the package is imported.
+    """
+
+    def test_import_lazy_dependencies(self):
+        """
+        Twisted, OpenSSL, mock, bunch and the zope interface verification
+        are not imported together with the package, as they are slow to
+        import and are only needed by some tests.
+        """
+        code = (
+            'import sys\n'
+            'import chevah.empirical\n'
+            'names = [\n'
+            '    "twisted.internet.reactor",\n'
+            '    "twisted.internet.posixbase",\n'
+            '    "twisted.internet.defer",\n'
+            '    "OpenSSL",\n'
+            '    "mock",\n'
+            '    "bunch",\n'
+            '    "zope.interface.verify",\n'
+            '    ]\n'
+            'print([name for name in names if name in sys.modules])\n'
+            )
+        environment = os.environ.copy()
+        environment['PYTHONPATH'] = os.pathsep.join(sys.path)
+
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=environment)
+
+        self.assertEqual(b'[]', output.strip())
+
+    def test_lazy_class_attributes(self):
+        """
+        The class attributes based on the lazy imported dependencies are
+        available on first use.
+        """
+        from bunch import Bunch
+        from mock import Mock
+        from twisted.internet.posixbase import _UnixWaker
+
+        self.assertIs(Bunch, self.Bunch)
+        self.assertIs(Mock, self.Mock)
+        self.assertIn(self.EXCEPTED_READERS, _UnixWaker)
+        self.assertEqual(socket.gethostname(), self.hostname)
+
+    def test_reactor(self):
+        """
+        Once the test is set up, the module reactor and the reactor used by
+        the test helpers are the Twisted reactor, and not the placeholder
+        used before Twisted is imported.
+        """
+        self.assertIs(reactor, testcase.reactor)
+        self.assertIs(reactor, self._reactor_tracker._reactor)
+        self.assertIs(reactor, self._thread_pool_monitor._reactor)
+        self.assertIs(defer, testcase._get_twisted('internet.defer'))
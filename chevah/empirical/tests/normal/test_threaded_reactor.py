@@ -0,0 +1,192 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Tests for the reactor running in a separate thread.
+
+The reactor thread is started in a separate process, so that it does not
+interfere with the reactor used by the tests.
+"""
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+import os
+import subprocess
+import sys
+
+from chevah.empirical import EmpiricalTestCase
+from chevah.empirical.threaded_reactor import blocking_call
+
+
+class TestThreadedReactor(EmpiricalTestCase):
+    """
+    Tests for get_reactor and blocking_call.
+    """
+
+    def runCode(self, code):
+        """
+        Run `code` in a separate process and return its output.
+        """
+        environment = os.environ.copy()
+        environment['PYTHONPATH'] = os.pathsep.join(sys.path)
+        code = (
+            'from __future__ import print_function\n'
+            'from twisted.internet import defer, reactor\n'
+            'from chevah.empirical import threaded_reactor\n'
+            ) + code
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=environment)
+        return output.decode('utf-8').strip().splitlines()
+
+    def test_get_reactor(self):
+        """
+        The reactor is running in a separate thread when get_reactor
+        returns, and the same reactor is returned by the next calls.
+        """
+        output = self.runCode(
+            'result = threaded_reactor.get_reactor()\n'
+            'print(result is reactor)\n'
+            'print(reactor.running)\n'
+            'print(threaded_reactor.get_reactor() is result)\n'
+            'threaded_reactor.stop_reactor()\n'
+            'print(threaded_reactor._twisted_thread)\n'
+            )
+
+        self.assertEqual(['True', 'True', 'True', 'None'], output)
+
+    def test_get_reactor_start_failure(self):
+        """
+        When the reactor fails to start, it fails without waiting for the
+        timeout, and the reactor can be started by the next call.
+        """
+        output = self.runCode(
+            'def run(installSignalHandlers):\n'
+            '    raise RuntimeError("bad run")\n'
+            'original_run = reactor.run\n'
+            'reactor.run = run\n'
+            'threaded_reactor.START_TIMEOUT = 60\n'
+            'try:\n'
+            '    threaded_reactor.get_reactor()\n'
+            'except AssertionError as error:\n'
+            '    print(error)\n'
+            'print(threaded_reactor._twisted_thread)\n'
+            'print(threaded_reactor._reactor)\n'
+            'reactor.run = original_run\n'
+            'print(threaded_reactor.get_reactor().running)\n'
+            'threaded_reactor.stop_reactor()\n'
+            )
+
+        self.assertEqual([
+            'Failed to start the reactor. bad run',
+            'None',
+            'None',
+            'True',
+            ], output)
+
+    def test_get_reactor_timeout(self):
+        """
+        It fails when the reactor does not run in START_TIMEOUT seconds,
+        and the reactor thread is kept, so that the next call waits for the
+        same thread instead of starting a new one.
+        """
+        output = self.runCode(
+            'import threading\n'
+            'reactor.callWhenRunning = (\n'
+            '    lambda callback: reactor.callLater(0.5, callback))\n'
+            'threaded_reactor.START_TIMEOUT = 0.1\n'
+            'try:\n'
+            '    threaded_reactor.get_reactor()\n'
+            'except AssertionError as error:\n'
+            '    print(error)\n'
+            'thread = threaded_reactor._twisted_thread\n'
+            'print(thread.isAlive())\n'
+            'threaded_reactor.START_TIMEOUT = 60\n'
+            'print(threaded_reactor.get_reactor() is reactor)\n'
+            'print(threaded_reactor._twisted_thread is thread)\n'
+            'print(len([\n'
+            '    item for item in threading.enumerate()\n'
+            '    if item.getName() == "threaded_reactor"]))\n'
+            'threaded_reactor.stop_reactor()\n'
+            )
+
+        self.assertEqual([
+            'Failed to start the reactor. Timeout.',
+            'True',
+            'True',
+            'True',
+            '1',
+            ], output)
+
+    def test_blocking_call(self):
+        """
+        The function is called in the reactor thread and its result is
+        returned, waiting for the deferred results.
+        """
+        output = self.runCode(
+            'import threading\n'
+            'threaded_reactor.get_reactor()\n'
+            'print(threaded_reactor.blocking_call(\n'
+            '    lambda: threading.current_thread().getName()))\n'
+            'print(threaded_reactor.blocking_call(lambda x: x + 1, 1))\n'
+            'def delayed():\n'
+            '    deferred = defer.Deferred()\n'
+            '    reactor.callLater(0.01, deferred.callback, "later")\n'
+            '    return deferred\n'
+            'print(threaded_reactor.blocking_call(delayed))\n'
+            'threaded_reactor.stop_reactor()\n'
+            )
+
+        self.assertEqual(['threaded_reactor', '2', 'later'], output)
+
+    def test_blocking_call_error(self):
+        """
+        Errors raised in the reactor thread are raised again in the caller
+        thread, and the next calls are not affected.
+        """
+        output = self.runCode(
+            'threaded_reactor.get_reactor()\n'
+            'def fail():\n'
+            '    raise ValueError("bad value")\n'
+            'try:\n'
+            '    threaded_reactor.blocking_call(fail)\n'
+            'except ValueError as error:\n'
+            '    print(error)\n'
+            'try:\n'
+            '    threaded_reactor.blocking_call(defer.fail, KeyError("k"))\n'
+            'except KeyError as error:\n'
+            '    print(error)\n'
+            'print(threaded_reactor.blocking_call(lambda: "ok"))\n'
+            'threaded_reactor.stop_reactor()\n'
+            )
+
+        self.assertEqual(['bad value', "'k'", 'ok'], output)
+
+    def test_blocking_call_timeout(self):
+        """
+        It fails when there is no result in CALL_TIMEOUT seconds, and the
+        next calls are not affected.
+        """
+        output = self.runCode(
+            'threaded_reactor.get_reactor()\n'
+            'threaded_reactor.CALL_TIMEOUT = 0.1\n'
+            'try:\n'
+            '    threaded_reactor.blocking_call(defer.Deferred)\n'
+            'except AssertionError as error:\n'
+            '    print(error)\n'
+            'print(threaded_reactor.blocking_call(lambda: "ok"))\n'
+            'threaded_reactor.stop_reactor()\n'
+            )
+
+        self.assertEqual([
+            'No result from the reactor thread in 0.1 seconds.',
+            'ok',
+            ], output)
+
+    def test_blocking_call_not_started(self):
+        """
+        It fails when the reactor thread was not started.
+        """
+        with self.assertRaises(AssertionError) as context:
+            blocking_call(lambda: None)
+
+        self.assertEqual(
+            'Reactor thread is not started.', context.exception.args[0])
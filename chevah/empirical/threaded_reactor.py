@@ -7,11 +7,27 @@ This code is under based on nose/twistedtools.py which is under LGPL license.
 from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
-from threading import Thread
+from collections import deque
+from threading import current_thread, Event, Lock, Thread
+import sys
 import time
 
+# Number of seconds to wait for the reactor thread to start.
+START_TIMEOUT = 5
+# Number of seconds to wait for the result of a blocking_call.
+CALL_TIMEOUT = 60
+
 _twisted_thread = None
 _reactor = None
+# Set once the reactor from the reactor thread is running.
+_running = None
+# Errors raised while starting the reactor.
+_start_errors = []
+# Times to only yield to other threads, before sleeping, while waiting
+# for a result on Python 2.
+_YIELD_SPINS = 1000
+# Result slots which can be reused by blocking_call.
+_free_slots = deque()
 
 
 def get_reactor():
@@ -19,28 +35,58 @@ def get_reactor():
     Start the Twisted reactor in a separate thread, if not already done.
     Returns the reactor.
     The thread will automatically be destroyed when all the tests are done.
+
+    When the reactor does not start in START_TIMEOUT seconds, the reactor
+    thread is kept, as it might still start the reactor, and the next
+    call waits for the same thread.
     """
-    global _twisted_thread, _reactor
+    global _twisted_thread, _reactor, _running, _start_errors
+
+    if _twisted_thread is not None and _running.is_set():
+        if _twisted_thread.isAlive():
+            return _reactor
+        # The reactor was stopped without stop_reactor.
+        _twisted_thread = None
 
-    if _twisted_thread:
-        return _reactor
+    if _twisted_thread is None:
+        running = Event()
+        errors = []
 
-    def reactor_run():
-        _reactor.__init__()
-        _reactor._startedBefore = False
-        _reactor._started = False
-        _reactor.run(installSignalHandlers=False)
+        def reactor_run():
+            try:
+                _reactor.__init__()
+                _reactor._startedBefore = False
+                _reactor._started = False
+                _reactor.callWhenRunning(running.set)
+                _reactor.run(installSignalHandlers=False)
+            except Exception as error:
+                errors.append(error)
+                # Don't wait for the timeout, as the reactor will not start.
+                running.set()
 
-    from twisted.internet import reactor as twisted_reactor
-    _reactor = twisted_reactor
+        from twisted.internet import reactor as twisted_reactor
+        _reactor = twisted_reactor
+        _running = running
+        _start_errors = errors
 
-    _twisted_thread = Thread(target=reactor_run)
-    _twisted_thread.setName('threaded_reactor')
-    _twisted_thread.setDaemon(True)
-    _twisted_thread.start()
+        _twisted_thread = Thread(target=reactor_run)
+        _twisted_thread.setName('threaded_reactor')
+        _twisted_thread.setDaemon(True)
+        _twisted_thread.start()
+
+    _running.wait(START_TIMEOUT)
+    if _start_errors:
+        # The thread exits right after the error, so it is safe to start
+        # again on the next call.
+        _twisted_thread.join()
+        error = _start_errors[0]
+        _twisted_thread = None
+        _reactor = None
+        raise AssertionError('Failed to start the reactor. %s' % (error,))
+
+    if not _running.is_set():
+        raise AssertionError('Failed to start the reactor. Timeout.')
 
-    # Wait a bit for the reactor to start.
-    time.sleep(0.01)
     return _reactor
 
 
@@ -67,3 +113,101 @@ def stop_reactor():
         raise AssertionError('Failed to stop the reactor.')
 
     _twisted_thread = None
+
+
+class _ResultSlot(object):
+    """
+    Holds the result of a call made in the reactor thread.
+
+    The lock is kept acquired while the slot is not used, and is released
+    by the reactor thread once the result is available.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.lock.acquire()
+        self.result = None
+
+    def setResult(self, result):
+        """
+        Called in the reactor thread with the result of the call.
+        """
+        self.result = result
+        self.lock.release()
+
+
+def _call_in_reactor(slot, function, args, kwargs):
+    """
+    Called in the reactor thread to execute `function` and store its
+    result in `slot`.
+    """
+    from twisted.internet.defer import maybeDeferred
+    maybeDeferred(function, *args, **kwargs).addBoth(slot.setResult)
+
+
+def _acquire(lock, timeout):
+    """
+    Acquire `lock`, waiting at most `timeout` seconds.
+
+    Return False when the lock was not acquired.
+    """
+    if sys.version_info[0] >= 3:
+        return lock.acquire(True, timeout)
+
+    # Python 2 locks can not wait with a timeout. Yield to the other
+    # threads before sleeping, so that the fast calls are not delayed.
+    end = time.time() + timeout
+    spins = 0
+    delay = 0.0001
+    while not lock.acquire(False):
+        remaining = end - time.time()
+        if remaining <= 0:
+            return False
+        if spins < _YIELD_SPINS:
+            spins += 1
+            time.sleep(0)
+            continue
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+    return True
+
+
+def blocking_call(function, *args, **kwargs):
+    """
+    Call `function` in the reactor thread and wait for its result.
+
+    When `function` returns a deferred, it waits for the deferred
+    result.
+    Errors raised in the reactor thread are raised again in the caller
+    thread.
+    It fails when there is no result in CALL_TIMEOUT seconds.
+
+    Result slots are reused between calls, so that each call only has the
+    cost of sending the call to the reactor.
+    """
+    from twisted.python.failure import Failure
+
+    if not _twisted_thread:
+        raise AssertionError('Reactor thread is not started.')
+    if current_thread() is _twisted_thread:
+        raise AssertionError('Can not wait for a call in reactor thread.')
+
+    try:
+        slot = _free_slots.pop()
+    except IndexError:
+        slot = _ResultSlot()
+
+    _reactor.callFromThread(_call_in_reactor, slot, function, args, kwargs)
+    if not _acquire(slot.lock, CALL_TIMEOUT):
+        # The slot is not reused, as the result might still be set.
+        raise AssertionError(
+            'No result from the reactor thread in %s seconds.' % (
+                CALL_TIMEOUT,))
+
+    result = slot.result
+    slot.result = None
+    _free_slots.append(slot)
+
+    if isinstance(result, Failure):
+        result.raiseException()
+    return result
@@ -0,0 +1,43 @@
+# Copyright (c) 2017 Adi Roiban.
+# See LICENSE for details.
+"""
+Micro-benchmark for the round-trip latency of
+`threaded_reactor.blocking_call`.
+
+Usage: python scripts/benchmark_blocking_call.py [COUNT]
+"""
+from __future__ import print_function
+import sys
+import time
+
+from chevah.empirical.threaded_reactor import (
+    blocking_call,
+    get_reactor,
+    stop_reactor,
+    )
+
+
+def main():
+    """
+    Time COUNT calls to a function which does nothing.
+    """
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    start = time.time()
+    get_reactor()
+    print('Reactor started in %.6f seconds.' % (time.time() - start))
+
+    start = time.time()
+    for _ in range(count):
+        blocking_call(lambda: None)
+    duration = time.time() - start
+    print('%d calls in %.6f seconds. %.2f microseconds per call.' % (
+        count, duration, duration * 1000000 / count))
+
+    stop_reactor()
+
+
+if __name__ == '__main__':
+    main()
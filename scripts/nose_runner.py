@@ -37,6 +37,7 @@ def main():
 
     # Delay import after coverage is started.
     from chevah.empirical.nose_memory_usage import MemoryUsage
+    from chevah.empirical.nose_reactor_usage import ReactorUsage
     from chevah.empirical.nose_test_timer import TestTimer
     from chevah.empirical.nose_run_reporter import RunReporter
 
@@ -54,6 +55,7 @@ def main():
         TestTimer(),
         RunReporter(),
         MemoryUsage(),
+        ReactorUsage(),
         ]
     try:
         nose_main(addplugins=plugins)
@@ -62,11 +64,26 @@ def main():
             cov.stop()
             cov.save()
         import threading
+        exit_code = error.code
+        try:
+            EmpiricalTestCase.releaseFixtures()
+        except AssertionError, release_error:
+            print release_error
+            exit_code = 1
+        # Tests only check the names generated by the factory, so do a
+        # full scan once per session for other test files left over.
+        members = (
+            EmpiricalTestCase.cleanTemporaryFolder() +
+            EmpiricalTestCase.cleanWorkingFolder()
+            )
+        if members:
+            print "Test files left over: %s" % (', '.join(members),)
+            exit_code = 1
         print "Max RSS: %s" % EmpiricalTestCase.getPeakMemoryUsage()
         threads = threading.enumerate()
         if len(threads) < 2:
             # No running threads, other than main so we can exit as normal.
-            sys.exit(error.code)
+            sys.exit(exit_code)
         else:
             print "There are still active threads: %s" % threads
 
@@ -77,7 +94,7 @@ def main():
             # Don't forget to flush the toilet.
             sys.stdout.flush()
             sys.stderr.flush()
-            os._exit(error.code)
+            os._exit(exit_code)
 
 if __name__ == '__main__':
     main()